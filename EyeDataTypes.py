@@ -1,3 +1,15 @@
+import numpy as np
+
+DEFAULT_BATCH_SIZE = 65536 # Rows fetched from the database at a time when building column stores
+
+# Converts windows time to Unix time
+def ConvertWindowsTime(t) -> int:
+    return ((t / 10000000) - 11644473600) * 1000
+
+# Converts Unix time (ms) to windows time
+def ConvertUnixTime(t) -> int:
+    return ((t / 1000) + 11644473600) * 10000000
+
 # Data Class for Gazes. Constructed from database data
 class Gaze:
     def __init__(self, init_tup):
@@ -20,3 +32,167 @@ class Fixation:
 
     def __str__(self):
         return "Fixation at "+str((self.x, self.y))
+
+
+# Column names and types of the gaze and fixation tables, in table order
+GAZE_COLUMNS = [("event_time", np.int64), ("session_id", np.int64), ("calibration_id", np.int64), ("participant_id", object),
+                ("tracker_time", np.int64), ("system_time", np.int64), ("x", np.float64), ("y", np.float64),
+                ("left_x", np.float64), ("left_y", np.float64), ("left_pupil_diameter", np.float64), ("left_validation", np.float64),
+                ("right_x", np.float64), ("right_y", np.float64), ("right_pupil_diameter", np.float64), ("right_validation", np.float64),
+                ("user_left_x", np.float64), ("user_left_y", np.float64), ("user_left_z", np.float64),
+                ("user_right_x", np.float64), ("user_right_y", np.float64), ("user_right_z", np.float64)]
+FIXATION_COLUMNS = [("fixation_id", np.int64), ("fixation_run_id", np.int64), ("fixation_start_event_time", np.int64),
+                    ("fixation_order_number", np.int64), ("x", np.float64), ("y", np.float64), ("fixation_target", object),
+                    ("source_file_line", np.int64), ("source_file_col", np.int64), ("token", object), ("syntactic_category", object),
+                    ("xpath", object), ("left_pupil_diameter", np.float64), ("right_pupil_diameter", np.float64), ("duration", np.float64)]
+# fixation_gaze rows joined with the system_time of their gaze
+FIXATION_GAZE_COLUMNS = [("fixation_id", np.int64), ("event_time", np.int64), ("system_time", np.int64)]
+# Screen positions of gazes or fixations
+POSITION_COLUMNS = [("x", np.float64), ("y", np.float64)]
+
+# Converts a single database value for a typed column. Unparsable values become NaN, or -1 in integer columns
+def _ConvertValue(value, dtype):
+    try:
+        return dtype(value)
+    except (ValueError, TypeError, OverflowError):
+        return np.nan if dtype is np.float64 else -1
+
+# Builds one typed column array from a sequence of database values
+def _BuildColumn(values, dtype):
+    if dtype is object:
+        return np.array(values, dtype=object)
+    try:
+        return np.array(values, dtype=dtype)
+    except (ValueError, TypeError, OverflowError):
+        return np.array([_ConvertValue(value, dtype) for value in values], dtype=dtype)
+
+
+# Attribute access to one row of a column store, for code that works with single Gazes or Fixations
+class RowView:
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __getattr__(self, name):
+        try:
+            value = self._store.columns[name][self._index]
+        except KeyError:
+            raise AttributeError(name) from None
+        return value.item() if isinstance(value, np.generic) else value
+
+# Structure of arrays holding one typed numpy array per table column.
+# Indexing with an int returns a row view, indexing with a slice or index array returns a smaller store.
+class ColumnStore:
+    COLUMNS = []
+    ROW_TYPE = RowView
+
+    def __init__(self, columns):
+        self.columns = columns
+        for name, _ in self.COLUMNS:
+            setattr(self, name, columns[name])
+
+    # Builds the store from an iterable of row lists, such as the batches of cursor.fetchmany
+    @classmethod
+    def from_batches(cls, batches):
+        parts = {name: [] for name, _ in cls.COLUMNS}
+        for rows in batches:
+            if len(rows) == 0:
+                continue
+            for (name, dtype), values in zip(cls.COLUMNS, zip(*rows)):
+                parts[name].append(_BuildColumn(values, dtype))
+        columns = {}
+        for name, dtype in cls.COLUMNS:
+            columns[name] = np.concatenate(parts[name]) if len(parts[name]) != 0 else np.empty(0, dtype=dtype)
+        return cls(columns)
+
+    # Builds the store from an executed cursor, fetching batch_size rows at a time
+    @classmethod
+    def from_cursor(cls, cursor, batch_size=DEFAULT_BATCH_SIZE):
+        return cls.from_batches(iter(lambda: cursor.fetchmany(batch_size), []))
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls.from_batches([rows])
+
+    # Yields one store per batch of batch_size rows fetched from an executed cursor, so a large
+    # result can be consumed without ever holding all of it
+    @classmethod
+    def iter_cursor(cls, cursor, batch_size=DEFAULT_BATCH_SIZE):
+        for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+            yield cls.from_rows(rows)
+
+    # Joins a list of stores end to end
+    @classmethod
+    def concatenate(cls, stores):
+        if len(stores) == 1:
+            return stores[0]
+        columns = {}
+        for name, dtype in cls.COLUMNS:
+            columns[name] = np.concatenate([store.columns[name] for store in stores]) if len(stores) != 0 else np.empty(0, dtype=dtype)
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns[self.COLUMNS[0][0]])
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if index < 0 or index >= len(self):
+                raise IndexError(index)
+            return self.ROW_TYPE(self, index)
+        return type(self)({name: column[index] for name, column in self.columns.items()})
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.ROW_TYPE(self, i)
+
+class GazeRow(RowView):
+    __slots__ = ()
+
+    def __str__(self):
+        return "Gaze at "+str((self.x, self.y))
+
+    def isNaN(self):
+        return bool(self._store.nan[self._index])
+
+class FixationRow(RowView):
+    __slots__ = ()
+
+    def __str__(self):
+        return "Fixation at "+str((self.x, self.y))
+
+# Columnar store of Gazes. nan marks the gazes without a valid x/y, replacing Gaze.isNaN
+class GazeArray(ColumnStore):
+    COLUMNS = GAZE_COLUMNS
+    ROW_TYPE = GazeRow
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.nan = np.isnan(self.x) | np.isnan(self.y)
+
+# Columnar store of Fixations
+class FixationArray(ColumnStore):
+    COLUMNS = FIXATION_COLUMNS
+    ROW_TYPE = FixationRow
+
+# Columnar store of the fixation_gazes of a fixation run, ordered by fixation.
+# The rows of each fixation are contiguous: fixation_ids[i]'s rows are offsets[i] to offsets[i+1]
+class FixationGazeArray(ColumnStore):
+    COLUMNS = FIXATION_GAZE_COLUMNS
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        starts = np.flatnonzero(self.fixation_id[1:] != self.fixation_id[:-1]) + 1
+        self.offsets = np.concatenate(([0], starts, [len(self.fixation_id)])) if len(self.fixation_id) != 0 else np.zeros(1, dtype=np.int64)
+        self.fixation_ids = self.fixation_id[self.offsets[:-1]]
+
+    # Returns the slice of rows belonging to the i-th fixation
+    def fixation_slice(self, i):
+        return slice(int(self.offsets[i]), int(self.offsets[i+1]))
+
+# Columnar store of x/y screen positions
+class PositionArray(ColumnStore):
+    COLUMNS = POSITION_COLUMNS
@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+
+DEFAULT_QUEUE_SIZE = 8 # Frames buffered between stages
+
+_DONE = object()
+
+# Timing for one pipeline stage
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+
+    def fps(self):
+        return self.frames / self.busy if self.busy > 0 else 0
+
+# Occupancy samples for one bounded queue, taken every time a frame is put on it
+class QueueStats:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+
+    def sample(self, occupancy):
+        self.samples += 1
+        self.total += occupancy
+        self.max = max(self.max, occupancy)
+
+    def mean(self):
+        return self.total / self.samples if self.samples > 0 else 0
+
+
+# Three stage decode -> draw -> encode pipeline.
+# Decoding and encoding run on their own threads, connected to the drawing stage (which runs on the
+# calling thread) by bounded queues. OpenCV releases the GIL while reading and writing frames, so
+# the three stages overlap. A full decode queue means drawing is the bottleneck; a full encode
+# queue means encoding is.
+class FramePipeline:
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.decode_stats = StageStats("decode")
+        self.draw_stats = StageStats("draw")
+        self.encode_stats = StageStats("encode")
+        self.decoded_stats = QueueStats("decoded", queue_size)
+        self.encoded_stats = QueueStats("drawn", queue_size)
+        self.wall = 0.0
+
+    # read() -> (ret, img) decodes the next frame, draw(index, img) returns the list of frames to write
+    # for it, and write(img) encodes one frame. Runs until frames frames were read or read() fails.
+    # Returns the number of frames written
+    def run(self, read, draw, write, frames):
+        decoded = queue.Queue(self.queue_size)
+        drawn = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        errors = []
+
+        def put(q, item, stats):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    if stats is not None:
+                        stats.sample(q.qsize())
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def decode():
+            try:
+                for index in range(frames):
+                    t = time.perf_counter()
+                    ret, img = read()
+                    self.decode_stats.busy += time.perf_counter() - t
+                    if not ret:
+                        break
+                    self.decode_stats.frames += 1
+                    if not put(decoded, (index, img), self.decoded_stats):
+                        return
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                put(decoded, _DONE, None)
+
+        def encode():
+            try:
+                while True:
+                    item = drawn.get()
+                    if item is _DONE:
+                        return
+                    t = time.perf_counter()
+                    write(item)
+                    self.encode_stats.busy += time.perf_counter() - t
+                    self.encode_stats.frames += 1
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        start = time.perf_counter()
+        decoder = threading.Thread(target=decode, name="decode", daemon=True)
+        encoder = threading.Thread(target=encode, name="encode", daemon=True)
+        decoder.start()
+        encoder.start()
+        try:
+            while not stop.is_set():
+                try:
+                    item = decoded.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                t = time.perf_counter()
+                outputs = draw(*item)
+                self.draw_stats.busy += time.perf_counter() - t
+                self.draw_stats.frames += 1
+                for img in outputs:
+                    if not put(drawn, img, self.encoded_stats):
+                        break
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            # The encoder always gets its sentinel so it finishes writing what was drawn
+            while encoder.is_alive():
+                try:
+                    drawn.put(_DONE, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            encoder.join()
+            stop.set()
+            decoder.join()
+            self.wall = time.perf_counter() - start
+
+        if errors:
+            raise errors[0]
+        return self.encode_stats.frames
+
+    # Returns a multi-line report of per stage throughput and queue occupancy
+    def summary(self):
+        lines = [f"Pipeline: {self.encode_stats.frames} frames in {self.wall:.2f}s"]
+        for stage in (self.decode_stats, self.draw_stats, self.encode_stats):
+            lines.append(f"  {stage.name:<7} {stage.frames:>7} frames  {stage.busy:8.2f}s busy  {stage.fps():8.1f} fps")
+        for q in (self.decoded_stats, self.encoded_stats):
+            lines.append(f"  {q.name:<7} queue  mean {q.mean():4.1f} / {q.size}  max {q.max}")
+        bottleneck = max((self.decode_stats, self.draw_stats, self.encode_stats), key=lambda stage: stage.busy)
+        lines.append(f"  bottleneck: {bottleneck.name}")
+        return "\n".join(lines)
@@ -0,0 +1,180 @@
+import cv2
+import numpy as np
+
+# Cache of boolean disk masks, keyed by radius
+_DISK_MASKS = {}
+
+# Returns a (2r x 2r) boolean mask of the pixels within radius of the center.
+# The mask covers [c-r, c+r) on both axes, the square the gaze circles have always been drawn over
+def disk_mask(radius):
+    mask = _DISK_MASKS.get(radius)
+    if mask is None:
+        offsets = np.arange(-radius, radius)
+        mask = (offsets[:, None] ** 2 + offsets[None, :] ** 2) < radius * radius
+        _DISK_MASKS[radius] = mask
+    return mask
+
+# Returns (x0, y0, mask) for an opaque polyline through the (N, 2) int32 points drawn on a (height, width) overlay:
+# a boolean mask of its pixels over the box it covers, clipped to the overlay. None when it misses the overlay
+def polyline_mask(pts, thickness, height, width):
+    x0, y0 = max(int(pts[:, 0].min()) - thickness, 0), max(int(pts[:, 1].min()) - thickness, 0)
+    x1, y1 = min(int(pts[:, 0].max()) + thickness + 1, width), min(int(pts[:, 1].max()) + thickness + 1, height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.polylines(mask, [pts - (x0, y0)], False, 255, thickness)
+    return x0, y0, mask != 0
+
+# Size in pixels of the tiles used to track which parts of the overlay were drawn on
+OVERLAY_TILE_SIZE = 32
+
+# Display list of overlay primitives for one frame.
+# Primitives are rasterized in order into a premultiplied BGRA overlay the size of the frame,
+# which is then blended onto the frame in one pass over the tiles that were drawn on.
+# The overlay buffers are kept between frames, so only touched tiles are ever cleared or blended.
+class Overlay:
+    def __init__(self):
+        self.items = []
+        self.color = None
+        self.alpha = None
+        self.scratch = None
+        self.dirty = None
+
+    def clear(self):
+        self.items = []
+
+    # Adds a run of circles sharing one color: points is a list of (cx, cy), and radii and
+    # transparencies (0-100) are either single values or lists matching points
+    def add_circles(self, points, radii, bgr, transparencies):
+        if len(points) == 0:
+            return
+        if np.isscalar(radii):
+            radii = [radii] * len(points)
+        if np.isscalar(transparencies):
+            transparencies = [transparencies] * len(points)
+        self.items.append(("circles", (points, radii, transparencies), bgr))
+
+    def add_circle(self, cx, cy, radius, bgr, transparency):
+        self.add_circles([(cx, cy)], radius, bgr, transparency)
+
+    # Adds an opaque polyline through the list of (x, y) points
+    def add_polyline(self, points, bgr, thickness):
+        if len(points) < 2:
+            return
+        self.items.append(("polyline", (np.array(points, dtype=np.int32), thickness), bgr))
+
+    # Adds opaque pixels given as a boolean mask with its top left corner at (x0, y0), such as one from polyline_mask
+    def add_mask(self, x0, y0, mask, bgr):
+        self.items.append(("mask", (x0, y0, mask), bgr))
+
+    def _ensure_buffers(self, height, width):
+        if self.alpha is None or self.alpha.shape != (height, width):
+            self.color = np.zeros((height, width, 3), dtype=np.float32)
+            self.alpha = np.zeros((height, width), dtype=np.float32)
+            self.scratch = np.zeros(height * width, dtype=np.float32)
+            self.dirty = np.zeros((-(-height // OVERLAY_TILE_SIZE), -(-width // OVERLAY_TILE_SIZE)), dtype=bool)
+
+    # Clips (x0, y0, x1, y1) to the overlay and marks its tiles as drawn on. Returns None if empty
+    def _touch(self, x0, y0, x1, y1):
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.alpha.shape[1]), min(y1, self.alpha.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return None
+        self.dirty[y0 // OVERLAY_TILE_SIZE:(y1 - 1) // OVERLAY_TILE_SIZE + 1, x0 // OVERLAY_TILE_SIZE:(x1 - 1) // OVERLAY_TILE_SIZE + 1] = True
+        return x0, y0, x1, y1
+
+    # Rasterizes the display list and blends it onto the frame (in place)
+    def composite(self, frame):
+        if len(self.items) == 0:
+            return
+        self._ensure_buffers(frame.shape[0], frame.shape[1])
+
+        for kind, data, bgr in self.items:
+            bgr = np.asarray(bgr, dtype=np.float32)
+            if kind == "circles":
+                self._rasterize_circles(data, bgr)
+            elif kind == "polyline":
+                self._rasterize_polyline(data, bgr)
+            else:
+                self._rasterize_mask(data, bgr)
+        self.items = []
+
+        # Blend each horizontal run of touched tiles, then reset that part of the overlay
+        T = OVERLAY_TILE_SIZE
+        for row in np.flatnonzero(self.dirty.any(axis=1)):
+            cols = np.flatnonzero(self.dirty[row])
+            breaks = np.flatnonzero(np.diff(cols) != 1)
+            for start, end in zip(np.concatenate(([cols[0]], cols[breaks + 1])), np.concatenate((cols[breaks], [cols[-1]]))):
+                region = (slice(row * T, (row + 1) * T), slice(start * T, (end + 1) * T))
+                roi = frame[region]
+                out = self.color[region] + roi * (1 - self.alpha[region])[..., None]
+                roi[:] = np.clip(out, 0, 255).astype(np.uint8)
+                self.color[region] = 0
+                self.alpha[region] = 0
+        self.dirty[:] = False
+
+    # Marks the tiles touched by the (x0, y0, x1, y1) boxes given as arrays, assumed already clipped
+    def _touch_boxes(self, x0, y0, x1, y1):
+        T = OVERLAY_TILE_SIZE
+        tx0, ty0, tx1, ty1 = x0 // T, y0 // T, (x1 - 1) // T, (y1 - 1) // T
+        small = ((tx1 - tx0) <= 1) & ((ty1 - ty0) <= 1)
+        self.dirty[ty0[small], tx0[small]] = True
+        self.dirty[ty0[small], tx1[small]] = True
+        self.dirty[ty1[small], tx0[small]] = True
+        self.dirty[ty1[small], tx1[small]] = True
+        for i in np.flatnonzero(~small):
+            self.dirty[ty0[i]:ty1[i] + 1, tx0[i]:tx1[i] + 1] = True
+
+    # All circles of one item share a color, so "over" compositing them in any order leaves
+    # prod(1 - a) of what was below at each pixel. The log of that product is accumulated for
+    # every circle at once, one scatter-add per distinct radius.
+    def _rasterize_circles(self, data, bgr):
+        points, radii, transparencies = data
+        height, width = self.alpha.shape
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        radii = np.asarray(radii, dtype=np.int64)
+        alphas = np.clip(np.asarray(transparencies, dtype=np.float64) / 100, 0, 1)
+        keep = (radii > 0) & (points[:, 0] + radii > 0) & (points[:, 1] + radii > 0) & (points[:, 0] - radii < width) & (points[:, 1] - radii < height)
+        if not keep.any():
+            return
+        points, radii, alphas = points[keep], radii[keep], alphas[keep]
+        self._touch_boxes(np.maximum(points[:, 0] - radii, 0), np.maximum(points[:, 1] - radii, 0),
+                          np.minimum(points[:, 0] + radii, width), np.minimum(points[:, 1] + radii, height))
+
+        log_remain = np.log(np.maximum(1 - alphas, 1e-12)).astype(np.float32)
+        touched = []
+        for radius in np.unique(radii):
+            same = radii == radius
+            dy, dx = np.nonzero(disk_mask(int(radius)))
+            xs = (points[same, 0, None] + (dx - radius)[None, :]).ravel()
+            ys = (points[same, 1, None] + (dy - radius)[None, :]).ravel()
+            weights = np.repeat(log_remain[same], len(dx))
+            inside = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+            flat = ys[inside] * width + xs[inside]
+            np.add.at(self.scratch, flat, weights[inside])
+            touched.append(flat)
+        touched = np.sort(np.concatenate(touched))
+        touched = touched[np.concatenate(([True], touched[1:] != touched[:-1]))]
+
+        remain = np.exp(self.scratch[touched])
+        self.scratch[touched] = 0
+        color = self.color.reshape(-1, 3)
+        alpha = self.alpha.reshape(-1)
+        color[touched] = color[touched] * remain[:, None] + (1 - remain)[:, None] * bgr
+        alpha[touched] = 1 - remain * (1 - alpha[touched])
+
+    def _rasterize_polyline(self, data, bgr):
+        pts, thickness = data
+        line = polyline_mask(pts, thickness, *self.alpha.shape)
+        if line is not None:
+            self._rasterize_mask(line, bgr)
+
+    def _rasterize_mask(self, data, bgr):
+        x0, y0, mask = data
+        bounds = self._touch(x0, y0, x0 + mask.shape[1], y0 + mask.shape[0])
+        if bounds is None:
+            return
+        x0, y0, x1, y1 = bounds
+        mask = mask[:y1 - y0, :x1 - x0]
+        self.color[y0:y1, x0:x1][mask] = bgr
+        self.alpha[y0:y1, x0:x1][mask] = 1
@@ -0,0 +1,180 @@
+import threading
+import time
+
+from PySide6 import QtCore, QtWidgets, QtGui
+
+PREVIEW_WIDTH, PREVIEW_HEIGHT = 800, 450
+
+# Draws the most recently requested preview frame on its own thread, so decoding and drawing never block the GUI.
+# Requests overtaken by a newer one before they start are dropped, so scrubbing only draws where the bar stops.
+# on_frame(frame_number, img) is called on the worker thread with each drawn frame, and with None for img when
+# the frame could not be decoded
+class PreviewWorker(threading.Thread):
+    def __init__(self, frames, on_frame):
+        super().__init__(daemon=True)
+        self.frames = frames
+        self.on_frame = on_frame
+        self.condition = threading.Condition()
+        self.requested = None
+        self.running = True
+
+    def request(self, frame_number):
+        with self.condition:
+            self.requested = frame_number
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.requested is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame_number, self.requested = self.requested, None
+            img = self.frames.frame(frame_number)
+            # The ring buffer slot is reused later, the GUI thread gets its own copy
+            self.on_frame(frame_number, img.copy() if img is not None else None)
+
+
+# Window playing a video with the gaze overlay drawn live from a VideoRenderer.PreviewFrames.
+# Playback follows the wall clock at the video's frame rate, skipping frames when drawing falls behind.
+# The scrub bar jumps straight to any frame through the frames' FrameIndex, and stepping a frame
+# back or forward (buttons or the arrow keys) is served from the ring buffer when it can be
+class PreviewPlayer(QtWidgets.QWidget):
+    frameReady = QtCore.Signal(int, object)
+
+    def __init__(self, frames, title="Preview", parent=None):
+        super().__init__(parent)
+        self.frames = frames
+        self.setWindowTitle(title)
+        self.resize(PREVIEW_WIDTH, PREVIEW_HEIGHT + 60)
+
+        self.current = 0 # Frame on screen
+        self.waiting = False # A requested frame has not arrived yet
+        self.play_start = None # (wall time, frame) playback started from
+
+        self.preview_layout = QtWidgets.QGridLayout()
+        self.setLayout(self.preview_layout)
+
+        self.image_label = QtWidgets.QLabel(self)
+        self.image_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.image_label.setMinimumSize(320, 180)
+        self.image_label.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
+        self.preview_layout.addWidget(self.image_label,0,0,1,5)
+
+        self.scrub_bar = QtWidgets.QSlider(QtCore.Qt.Horizontal, self)
+        self.scrub_bar.setRange(0, max(len(frames) - 1, 0))
+        self.scrub_bar.valueChanged.connect(self.scrubbed)
+        self.preview_layout.addWidget(self.scrub_bar,1,0,1,5)
+
+        self.back_button = QtWidgets.QPushButton("<", self)
+        self.back_button.clicked.connect(lambda: self.step(-1))
+        self.preview_layout.addWidget(self.back_button,2,0)
+        self.play_button = QtWidgets.QPushButton("Play", self)
+        self.play_button.clicked.connect(self.playClicked)
+        self.preview_layout.addWidget(self.play_button,2,1)
+        self.forward_button = QtWidgets.QPushButton(">", self)
+        self.forward_button.clicked.connect(lambda: self.step(1))
+        self.preview_layout.addWidget(self.forward_button,2,2)
+        self.time_text = QtWidgets.QLabel("", self)
+        self.preview_layout.addWidget(self.time_text,2,4)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(max(int(1000 / frames.fps), 1))
+        self.timer.timeout.connect(self.tick)
+
+        # Emitted on the worker thread, delivered on the GUI thread
+        self.frameReady.connect(self.frameDrawn)
+        self.worker = PreviewWorker(frames, self.frameReady.emit)
+        self.worker.start()
+        self.showFrame(0)
+
+    # Asks the worker for a frame, replacing any request it has not started on
+    def showFrame(self, frame_number):
+        frame_number = min(max(frame_number, 0), len(self.frames) - 1)
+        self.waiting = True
+        self.worker.request(frame_number)
+
+    def frameDrawn(self, frame_number, img):
+        self.waiting = False
+        if img is None:
+            # Playing on would keep asking for frames that do not decode
+            self.pause()
+            self.time_text.setText("Frame " + str(frame_number) + " could not be decoded")
+            return
+        self.current = frame_number
+        height, width = img.shape[:2]
+        image = QtGui.QImage(img.data, width, height, img.strides[0], QtGui.QImage.Format_BGR888)
+        pixmap = QtGui.QPixmap.fromImage(image).scaled(self.image_label.size(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        self.image_label.setPixmap(pixmap)
+
+        self.scrub_bar.blockSignals(True)
+        self.scrub_bar.setValue(frame_number)
+        self.scrub_bar.blockSignals(False)
+        self.time_text.setText(self.formatTime(self.frames.time_of(frame_number)) + " / " + self.formatTime(self.frames.time_of(len(self.frames))) + "  Frame " + str(frame_number))
+
+    def scrubbed(self, frame_number):
+        if self.play_start is not None:
+            self.play_start = (time.time(), frame_number)
+        self.showFrame(frame_number)
+
+    def step(self, frames):
+        self.pause()
+        self.showFrame(self.current + frames)
+
+    def playClicked(self):
+        if self.play_start is None:
+            self.play()
+        else:
+            self.pause()
+
+    def play(self):
+        if self.current >= len(self.frames) - 1:
+            self.current = 0
+            self.showFrame(0)
+        self.play_start = (time.time(), self.current)
+        self.play_button.setText("Pause")
+        self.timer.start()
+
+    def pause(self):
+        self.play_start = None
+        self.play_button.setText("Play")
+        self.timer.stop()
+
+    # Requests the frame the wall clock has reached, unless the last one is still being drawn
+    def tick(self):
+        if self.waiting:
+            return
+        start_time, start_frame = self.play_start
+        frame_number = start_frame + int((time.time() - start_time) * self.frames.fps)
+        if frame_number >= len(self.frames):
+            self.showFrame(len(self.frames) - 1)
+            self.pause()
+        elif frame_number != self.current:
+            self.showFrame(frame_number)
+
+    def formatTime(self, seconds):
+        m, s = divmod(int(seconds), 60)
+        return str(m).zfill(2) + ":" + str(s).zfill(2)
+
+    def keyPressEvent(self, event):
+        if event.key() == QtCore.Qt.Key_Left:
+            self.step(-1)
+        elif event.key() == QtCore.Qt.Key_Right:
+            self.step(1)
+        elif event.key() == QtCore.Qt.Key_Space:
+            self.playClicked()
+        else:
+            super().keyPressEvent(event)
+
+    def closeEvent(self, event):
+        self.pause()
+        self.worker.stop()
+        self.worker.join()
+        self.frames.close()
+        super().closeEvent(event)
@@ -0,0 +1,411 @@
+import mmap
+import re
+import numpy as np
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from lxml import etree as ET
+
+XML_TAG = re.compile("<.*?>")
+
+# Characters that are tokens on their own. Other runs of letters and digits are words, and runs of any
+# other non-space characters are operators
+SINGLE_CHAR_TOKENS = ["{","}","[","]","(",")","'",'"',".",",",";"]
+# Character classes of the token rules
+CHAR_SPACE, CHAR_SINGLE, CHAR_WORD, CHAR_OP = 0, 1, 2, 3
+
+POS_START = "{http://www.srcML.org/srcML/position}start"
+POS_END = "{http://www.srcML.org/srcML/position}end"
+
+DEFAULT_UNIT_CACHE = 32 # Parsed units a LazySrcmlArchive keeps before evicting
+# A unit start tag, with any ">" inside quoted attribute values
+UNIT_START_TAG = re.compile(rb"""<unit\b(?:[^>"']|"[^"]*"|'[^']*')*>""")
+
+# Returns the source text of an srcML element, the way the heatmap has always read it: the serialized
+# element (with its tail), tags removed and &gt; &lt; &amp; unescaped
+def ElementText(element):
+    return XML_TAG.sub('', ET.tostring(element).decode()).replace("&gt;",">").replace("&lt;","<").replace("&amp;","&")
+
+# Decoded source text of an srcML element, split into lines once
+class UnitText:
+    def __init__(self, text, line_offsets=None):
+        self.text = text
+        self.lines = text.split("\n")
+        # Offset of the start of each line in text, and one past the end of the text
+        if line_offsets is None:
+            lengths = np.fromiter((len(line) + 1 for line in self.lines), dtype=np.int64, count=len(self.lines))
+            line_offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self.line_offsets = line_offsets
+
+    # Returns line number line (from 1)
+    def line(self, line):
+        return self.lines[line - 1]
+
+    # Returns the offset in text of line and col (both from 1)
+    def offset(self, line, col):
+        return int(self.line_offsets[line - 1]) + col - 1
+
+    # Returns the number of lines and the length of the longest line, ignoring trailing whitespace
+    def extent(self):
+        return len(self.lines), max([len(line.rstrip()) for line in self.lines])
+
+# Returns the token rule class of a character
+def CharClass(char):
+    if char.isspace():
+        return CHAR_SPACE
+    if char in SINGLE_CHAR_TOKENS:
+        return CHAR_SINGLE
+    if char.isalnum():
+        return CHAR_WORD
+    return CHAR_OP
+
+_ASCII_CLASSES = np.array([CharClass(chr(i)) for i in range(128)], dtype=np.int8)
+
+# Returns the token rule class of every character of text
+def CharClasses(text):
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    classes = _ASCII_CLASSES[np.minimum(codes, 127)]
+    for i in np.flatnonzero(codes > 127):
+        classes[i] = CharClass(text[i])
+    return classes
+
+# The tokens of a UnitText, found once: single character tokens, and runs of word or of operator characters.
+# char_tokens maps every character offset of the text to its token id (-1 for whitespace), and each token
+# has its line, first column and last column (from 1), so finding the token at a line and column is an
+# array lookup, for one position or for whole arrays of them
+class TokenIndex:
+    def __init__(self, text):
+        self.text = text
+        classes = CharClasses(text.text)
+        in_token = classes != CHAR_SPACE
+        # A token starts where the class changes, and at every single character token
+        starts = in_token.copy()
+        starts[1:] &= (classes[1:] != classes[:-1]) | (classes[1:] == CHAR_SINGLE)
+        self.char_tokens = np.where(in_token, np.cumsum(starts) - 1, -1)
+
+        token_starts = np.flatnonzero(starts)
+        ends = in_token.copy()
+        ends[:-1] &= starts[1:] | ~in_token[1:]
+        token_ends = np.flatnonzero(ends) + 1
+        self.lines = np.searchsorted(text.line_offsets, token_starts, 'right')
+        line_starts = text.line_offsets[self.lines - 1]
+        self.start_cols = token_starts - line_starts + 1
+        self.end_cols = token_ends - line_starts
+
+    # Returns the TokenIndex of text from arrays saved from another one, without tokenizing again
+    @classmethod
+    def from_arrays(cls, text, char_tokens, lines, start_cols, end_cols):
+        tokens = cls.__new__(cls)
+        tokens.text = text
+        tokens.char_tokens = char_tokens
+        tokens.lines = lines
+        tokens.start_cols = start_cols
+        tokens.end_cols = end_cols
+        return tokens
+
+    def __len__(self):
+        return len(self.lines)
+
+    # Returns the span of token id as ((line, start col), (line, end col))
+    def span(self, token):
+        line = int(self.lines[token])
+        return ((line, int(self.start_cols[token])), (line, int(self.end_cols[token])))
+
+    # Returns the token ids at arrays of lines and cols (from 1), -1 on whitespace or outside the text
+    def lookup(self, lines, cols):
+        lines = np.asarray(lines, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tokens = np.full(len(lines), -1, dtype=np.int64)
+        line_offsets = self.text.line_offsets
+        valid = (lines >= 1) & (lines < len(line_offsets)) & (cols >= 1)
+        line_starts = line_offsets[lines[valid] - 1]
+        # Line lengths without the newline
+        valid[valid] &= cols[valid] <= line_offsets[lines[valid]] - line_starts - 1
+        tokens[valid] = self.char_tokens[line_offsets[lines[valid] - 1] + cols[valid] - 1]
+        return tokens
+
+    # Returns the span of the token at line and col (from 1), or None on whitespace or outside the text
+    def find(self, line, col):
+        token = int(self.lookup([line], [col])[0])
+        return self.span(token) if token != -1 else None
+
+# Adds up weights (by default 1 each) over the tokens at arrays of lines and cols. Returns a dict from
+# token span, as in TokenIndex.span, to total, in the order the tokens were first hit.
+# Positions on whitespace or outside the text are left out
+def CountTokens(tokens, lines, cols, weights=None):
+    ids = tokens.lookup(lines, cols)
+    hit = ids != -1
+    ids = ids[hit]
+    if weights is None:
+        totals = np.bincount(ids, minlength=len(tokens))
+    else:
+        weights = np.asarray(weights)[hit]
+        totals = np.zeros(len(tokens), dtype=weights.dtype)
+        # Unbuffered, so repeated tokens add up in order
+        np.add.at(totals, ids, weights)
+    hit_tokens, first = np.unique(ids, return_index=True)
+    return {tokens.span(token): totals[token].item() for token in hit_tokens[np.argsort(first)]}
+
+# Returns the (line, col, end line, end col) of an element's pos:start/pos:end attributes, or None when it has none
+def PositionSpan(element):
+    try:
+        start_line, start_col = element.attrib[POS_START].split(":")
+        end_line, end_col = element.attrib[POS_END].split(":")
+        return int(start_line), int(start_col), int(end_line), int(end_col)
+    except (KeyError, ValueError):
+        return
+
+# Returns the name of an element's tag with its srcML prefix, such as "name" or "cpp:include"
+def ElementTag(element):
+    tag = ET.QName(element).localname
+    return f"{element.prefix}:{tag}" if element.prefix else tag
+
+# Packs lines and cols into single keys that sort in position order
+def _PositionKeys(lines, cols):
+    return (np.asarray(lines, dtype=np.int64) << 32) | np.asarray(cols, dtype=np.int64)
+
+# The position spans of the elements of a srcML unit, built in one pass over its start/end events
+# (from ET.iterparse, or ET.iterwalk over a parsed unit). Elements without pos:start/pos:end are left out.
+# Spans nest, so they cut the unit into segments, each owned by the innermost element covering it.
+# Finding the element at a line and column is a binary search over the segment starts
+class ElementIndex:
+    def __init__(self, events):
+        self.tag_names = [] # Distinct tags, indexed by tag_codes
+        tag_numbers = {}
+        tag_codes, spans, parents = [], [], []
+        segment_keys, segment_owners = [], []
+        open_elements = [] # Ids of the positioned elements around the current event
+        pushed = [] # Whether each open element is in open_elements
+        for event, element in events:
+            if not isinstance(element.tag, str):
+                continue
+            if event == "start":
+                span = PositionSpan(element)
+                pushed.append(span is not None)
+                if span is None:
+                    continue
+                tag = ElementTag(element)
+                if tag not in tag_numbers:
+                    tag_numbers[tag] = len(self.tag_names)
+                    self.tag_names.append(tag)
+                element_id = len(spans)
+                tag_codes.append(tag_numbers[tag])
+                spans.append(span)
+                parents.append(open_elements[-1] if len(open_elements) != 0 else -1)
+                open_elements.append(element_id)
+                segment_keys.append((span[0] << 32) | span[1])
+                segment_owners.append(element_id)
+            elif pushed.pop():
+                # Past the element's last column its parent owns the text again
+                span = spans[open_elements.pop()]
+                segment_keys.append((span[2] << 32) | (span[3] + 1))
+                segment_owners.append(open_elements[-1] if len(open_elements) != 0 else -1)
+
+        self.tag_codes = np.array(tag_codes, dtype=np.int64)
+        self.spans = np.array(spans, dtype=np.int64).reshape(-1, 4)
+        self.parents = np.array(parents, dtype=np.int64)
+        # Stable, so of segments starting together the last one, the innermost, wins
+        order = np.argsort(np.array(segment_keys, dtype=np.int64), kind="stable")
+        self.segment_keys = np.array(segment_keys, dtype=np.int64)[order]
+        self.segment_owners = np.array(segment_owners, dtype=np.int64)[order]
+
+    # Returns the ElementIndex from arrays saved from another one, without reading the elements again
+    @classmethod
+    def from_arrays(cls, tag_names, tag_codes, spans, parents, segment_keys, segment_owners):
+        elements = cls.__new__(cls)
+        elements.tag_names = tag_names
+        elements.tag_codes = tag_codes
+        elements.spans = spans
+        elements.parents = parents
+        elements.segment_keys = segment_keys
+        elements.segment_owners = segment_owners
+        return elements
+
+    def __len__(self):
+        return len(self.spans)
+
+    # Returns the tag of element id
+    def tag(self, element_id):
+        return self.tag_names[self.tag_codes[element_id]]
+
+    # Returns the span of element id as ((line, start col), (end line, end col))
+    def span(self, element_id):
+        line, col, end_line, end_col = (int(v) for v in self.spans[element_id])
+        return ((line, col), (end_line, end_col))
+
+    # Returns the ids of element id and the positioned elements around it, innermost first
+    def ancestors(self, element_id):
+        ids = []
+        while element_id != -1:
+            ids.append(element_id)
+            element_id = int(self.parents[element_id])
+        return ids
+
+    # Returns the ids of the innermost elements at arrays of lines and cols (from 1), -1 outside every element
+    def lookup(self, lines, cols):
+        lines = np.asarray(lines, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        segments = np.searchsorted(self.segment_keys, _PositionKeys(lines, cols), "right") - 1
+        owners = self.segment_owners[np.maximum(segments, 0)] if len(self.segment_keys) != 0 else np.full(len(lines), -1, dtype=np.int64)
+        return np.where((segments >= 0) & (lines >= 1) & (cols >= 1), owners, -1)
+
+    # Returns the id of the innermost element at line and col (from 1), or None
+    def find(self, line, col):
+        element_id = int(self.lookup([line], [col])[0])
+        return element_id if element_id != -1 else None
+
+# Adds up weights (by default 1 each) over the syntactic categories (tags of the innermost elements) at arrays
+# of lines and cols. Returns a dict from tag to total, in the order the tags were first hit.
+# Positions outside every element are left out
+def CountCategories(elements, lines, cols, weights=None):
+    ids = elements.lookup(lines, cols)
+    hit = ids != -1
+    codes = elements.tag_codes[ids[hit]]
+    if weights is None:
+        totals = np.bincount(codes, minlength=len(elements.tag_names))
+    else:
+        weights = np.asarray(weights)[hit]
+        totals = np.zeros(len(elements.tag_names), dtype=weights.dtype)
+        np.add.at(totals, codes, weights)
+    hit_codes, first = np.unique(codes, return_index=True)
+    return {elements.tag_names[code]: totals[code].item() for code in hit_codes[np.argsort(first)]}
+
+# A loaded srcML archive: its units by filename, and the decoded text, token index and element index of every
+# element asked for, each built once.
+# Elements are kept alive by the cache, so lxml hands back the same element objects for them
+class SrcmlArchive:
+    def __init__(self, root, units):
+        self.root = root
+        self.units = units
+        self.texts = {}
+        self.token_indexes = {}
+        self.element_indexes = {}
+
+    @classmethod
+    def parse(cls, path):
+        root = ET.parse(path).getroot()
+        return cls(root, {unit.attrib["filename"]: unit for unit in root if "filename" in unit.attrib})
+
+    # Returns the UnitText of an element of the archive, decoding it the first time
+    def text(self, element):
+        text = self.texts.get(element)
+        if text is None:
+            text = UnitText(ElementText(element))
+            self.texts[element] = text
+        return text
+
+    # Returns the TokenIndex of an element of the archive, building it the first time
+    def tokens(self, element):
+        tokens = self.token_indexes.get(element)
+        if tokens is None:
+            tokens = TokenIndex(self.text(element))
+            self.token_indexes[element] = tokens
+        return tokens
+
+    # Returns the ElementIndex of an element of the archive, building it the first time
+    def elements(self, element):
+        elements = self.element_indexes.get(element)
+        if elements is None:
+            elements = ElementIndex(ET.iterwalk(element, events=("start", "end")))
+            self.element_indexes[element] = elements
+        return elements
+
+    # Drops the cached text and indexes of the elements in the same tree as element.
+    # Keys that are not lxml elements (such as cached units standing in for them) belong to no tree and are kept
+    def forget(self, element):
+        root = element.getroottree().getroot()
+        for cache in (self.texts, self.token_indexes, self.element_indexes):
+            for element in [element for element in cache if isinstance(element, ET._Element) and element.getroottree().getroot() is root]:
+                del cache[element]
+
+# Units of a LazySrcmlArchive by filename, parsed when they are looked up
+class LazyUnits(Mapping):
+    def __init__(self, archive, filenames):
+        self.archive = archive
+        self.filenames = filenames
+
+    def __getitem__(self, filename):
+        return self.archive.unit(filename)
+
+    def __iter__(self):
+        return iter(self.filenames)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __contains__(self, filename):
+        return filename in self.filenames
+
+# A srcML archive read lazily, for archives too large to hold as one tree.
+# Opening it makes one iterparse pass over the file, clearing each unit as it ends, to list the units,
+# and finds the byte range of each unit (with its tail) in the file. A unit is only parsed when it is
+# looked up in units, from its own bytes, and the last max_units parsed units are kept with their text and indexes
+class LazySrcmlArchive(SrcmlArchive):
+    def __init__(self, path, max_units=DEFAULT_UNIT_CACHE):
+        self.path = path
+        self.max_units = max_units
+        self.loaded = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.root_tag, self.ranges = self.list_units()
+        super().__init__(ET.fromstring(self.root_tag + b"</unit>"), LazyUnits(self, list(self.ranges)))
+
+    @classmethod
+    def parse(cls, path, max_units=DEFAULT_UNIT_CACHE):
+        return cls(path, max_units)
+
+    # Reads the archive's start tag and the byte range of each unit with a filename, as (start tag, {filename: (start, end)})
+    def list_units(self):
+        path = self.path
+        filenames = []
+        depth = 0
+        for event, element in ET.iterparse(path, events=("start", "end"), tag="{*}unit"):
+            if event == "start":
+                depth += 1
+                if depth == 2:
+                    filenames.append(element.get("filename"))
+                continue
+            depth -= 1
+            if depth == 1:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            starts = [match.start() for match in UNIT_START_TAG.finditer(data)]
+            if len(starts) != len(filenames) + 1:
+                raise ValueError(f"Found {len(starts) - 1} unit tags in {path} but it has {len(filenames)} units")
+            root_tag = data[starts[0]:UNIT_START_TAG.match(data, starts[0]).end()]
+            # Each unit runs up to the next one, and the last up to the archive's end tag
+            ends = starts[2:] + [data.rfind(b"</unit>")]
+        return root_tag, {filename: (start, end) for filename, start, end in zip(filenames, starts[1:], ends) if filename is not None}
+
+    # Returns the unit of filename, loading it when it is not loaded
+    def unit(self, filename):
+        unit = self.loaded.get(filename)
+        if unit is not None:
+            self.hits += 1
+            self.loaded.move_to_end(filename)
+            return unit
+        self.misses += 1
+        unit = self.load_unit(filename)
+        self.loaded[filename] = unit
+        while len(self.loaded) > self.max_units:
+            _, evicted = self.loaded.popitem(last=False)
+            self.forget(evicted)
+        return unit
+
+    # Parses the unit element of filename from its bytes in the archive
+    def load_unit(self, filename):
+        start, end = self.ranges[filename]
+        with open(self.path, "rb") as file:
+            file.seek(start)
+            data = file.read(end - start)
+        # Inside a copy of the archive's start tag, for its namespaces
+        return ET.fromstring(self.root_tag + data + b"</unit>")[0]
+
+    # Returns a one line report of the units parsed and reused
+    def summary(self):
+        return (f"srcML units: {self.hits} reused, {self.misses} parsed, "
+                f"{len(self.loaded)} of {len(self.ranges)} loaded (at most {self.max_units})")
@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+
+from SrcmlArchive import LazySrcmlArchive, UnitText, TokenIndex, ElementIndex, DEFAULT_UNIT_CACHE
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "iTrace-Visualize", "srcml")
+CACHE_FORMAT = b"srcml-cache-1" # Hashed into the key, so caches in an older layout are never read
+HASH_CHUNK_BYTES = 1024 * 1024
+ARRAY_ALIGNMENT = 8
+HEADER_LENGTH_BYTES = 8
+
+# Returns a hex digest of the contents of the archive at path and the cache format
+def ArchiveDigest(path):
+    digest = hashlib.blake2b(CACHE_FORMAT, digest_size=16)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Stands in for a unit element whose text and indexes are read from a SrcmlCache instead of parsing it.
+# Has the unit's attributes, and works with the archive's text, tokens and elements
+class CachedUnit:
+    def __init__(self, filename, attrib):
+        self.filename = filename
+        self.attrib = attrib
+
+# Directory holding what was computed from one archive: its start tag and unit byte ranges in index.json, and for
+# each unit already read, its text, line offsets, token arrays and element arrays in one binary file named by a hash
+# of the unit's filename. A unit file starts with the length of a JSON header giving the unit's attributes, tag
+# names and the offset, type and shape of each array, and the arrays follow it. Unit files are memory mapped when loaded
+class SrcmlCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.index = None
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as index_file:
+                    self.index = json.load(index_file)
+            except (OSError, ValueError) as e:
+                print("Ignoring unreadable srcML cache", self.index_path, "-", e)
+
+    def has_listing(self):
+        return self.index is not None
+
+    # Returns the archive's start tag and unit byte ranges saved by save_listing
+    def listing(self):
+        return self.index["root_tag"].encode(), {filename: (start, end) for filename, start, end in self.index["ranges"]}
+
+    def save_listing(self, root_tag, ranges):
+        self.index = {"root_tag": root_tag.decode(), "ranges": [[filename, start, end] for filename, (start, end) in ranges.items()]}
+        self.write_file(self.index_path, json.dumps(self.index).encode())
+
+    def unit_path(self, filename):
+        return os.path.join(self.directory, hashlib.blake2b(filename.encode(), digest_size=16).hexdigest() + ".bin")
+
+    def has_unit(self, filename):
+        return self.index is not None and os.path.exists(self.unit_path(filename))
+
+    # Writes the arrays of a unit's text, tokens and elements to its own file
+    def save_unit(self, filename, attrib, text, tokens, elements):
+        arrays = {"text": np.frombuffer(text.text.encode(), dtype=np.uint8),
+                  "line_offsets": text.line_offsets,
+                  "char_tokens": tokens.char_tokens.astype(np.int32),
+                  "token_lines": tokens.lines, "token_start_cols": tokens.start_cols, "token_end_cols": tokens.end_cols,
+                  "tag_codes": elements.tag_codes, "spans": elements.spans, "parents": elements.parents,
+                  "segment_keys": elements.segment_keys, "segment_owners": elements.segment_owners}
+        layout = {}
+        parts = []
+        offset = 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            layout[name] = [offset, array.dtype.str, list(array.shape)]
+            padding = -array.nbytes % ARRAY_ALIGNMENT
+            parts += [array.tobytes(), bytes(padding)]
+            offset += array.nbytes + padding
+        header = json.dumps({"attrib": attrib, "tag_names": elements.tag_names, "arrays": layout}).encode()
+        header += b" " * (-(HEADER_LENGTH_BYTES + len(header)) % ARRAY_ALIGNMENT)
+        self.write_file(self.unit_path(filename), len(header).to_bytes(HEADER_LENGTH_BYTES, "little") + header + b"".join(parts))
+
+    # Returns a unit's attributes and its (UnitText, TokenIndex, ElementIndex), with the arrays mapped from its file
+    def load_unit(self, filename):
+        data = np.memmap(self.unit_path(filename), dtype=np.uint8, mode="r")
+        header_length = int.from_bytes(data[:HEADER_LENGTH_BYTES].tobytes(), "little")
+        header = json.loads(data[HEADER_LENGTH_BYTES:HEADER_LENGTH_BYTES + header_length].tobytes())
+        data = data[HEADER_LENGTH_BYTES + header_length:]
+        arrays = {}
+        for name, (offset, dtype, shape) in header["arrays"].items():
+            dtype = np.dtype(dtype)
+            arrays[name] = data[offset:offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+        text = UnitText(arrays["text"].tobytes().decode(), arrays["line_offsets"])
+        tokens = TokenIndex.from_arrays(text, arrays["char_tokens"], arrays["token_lines"], arrays["token_start_cols"], arrays["token_end_cols"])
+        elements = ElementIndex.from_arrays(header["tag_names"], arrays["tag_codes"], arrays["spans"], arrays["parents"],
+                                            arrays["segment_keys"], arrays["segment_owners"])
+        return header["attrib"], (text, tokens, elements)
+
+    # Writes a file of the cache in one step, so a reader never sees half of it
+    def write_file(self, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as out_file:
+            out_file.write(data)
+        os.replace(temp_path, path)
+
+# A LazySrcmlArchive that keeps what it reads in a SrcmlCache under cache_dir, keyed by a hash of the archive's
+# contents. Reopening an unchanged archive takes the unit list from the cache without reading any XML, and units
+# read before come back as CachedUnits with their text and indexes mapped from disk. Other units are parsed from
+# the archive as usual and added to the cache. When the cache cannot be written the archive still works, uncached
+class CachedSrcmlArchive(LazySrcmlArchive):
+    def __init__(self, path, cache_dir=DEFAULT_CACHE_DIR, max_units=DEFAULT_UNIT_CACHE):
+        self.cache = SrcmlCache(os.path.join(cache_dir, ArchiveDigest(path)))
+        self.cache_writable = True
+        self.cache_reads = 0
+        super().__init__(path, max_units)
+
+    @classmethod
+    def parse(cls, path, cache_dir=DEFAULT_CACHE_DIR, max_units=DEFAULT_UNIT_CACHE):
+        return cls(path, cache_dir, max_units)
+
+    def list_units(self):
+        if self.cache.has_listing():
+            return self.cache.listing()
+        root_tag, ranges = super().list_units()
+        self.write_cache(lambda: self.cache.save_listing(root_tag, ranges))
+        return root_tag, ranges
+
+    def load_unit(self, filename):
+        if self.cache.has_unit(filename):
+            self.cache_reads += 1
+            attrib, (text, tokens, elements) = self.cache.load_unit(filename)
+            unit = CachedUnit(filename, attrib)
+            self.texts[unit], self.token_indexes[unit], self.element_indexes[unit] = text, tokens, elements
+            return unit
+        unit = super().load_unit(filename)
+        if self.cache_writable and self.cache.has_listing():
+            self.write_cache(lambda: self.cache.save_unit(filename, dict(unit.attrib), self.text(unit), self.tokens(unit), self.elements(unit)))
+        return unit
+
+    def forget(self, element):
+        if isinstance(element, CachedUnit):
+            for cache in (self.texts, self.token_indexes, self.element_indexes):
+                cache.pop(element, None)
+        else:
+            super().forget(element)
+
+    # Runs a write to the cache, giving up on caching for this archive if it fails
+    def write_cache(self, write):
+        try:
+            write()
+        except OSError as e:
+            print("Not caching srcML units -", e)
+            self.cache_writable = False
+
+    def summary(self):
+        return super().summary() + f", {self.cache_reads} read from the cache in {self.cache.directory}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read every unit of a srcML archive into the cache, so the heatmaps never parse it again")
+    parser.add_argument("archive", help="srcML archive file")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory holding the caches of srcML archives")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    archive = CachedSrcmlArchive.parse(args.archive, args.cache_dir, max_units=1)
+    for filename in archive.units:
+        archive.unit(filename)
+    print(archive.summary())
+    print(f"Cached {len(archive.units)} units in {time.time() - started:.2f}s")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,117 +1,290 @@
 import cv2
+import hashlib
 import numpy as np
 import random
+from collections import OrderedDict
 
 import time
 
-X_ = 1
-Y_ = 0
-
-def flood_fill(frame, start_pos):
-    queue = []
-    pixels = []
-    queue.append(start_pos)
-    while len(queue) != 0:
-        n = queue.pop(0)
-        x = n[X_]
-        y = n[Y_]
-
-        if(frame[x,y] == 255):
-            #print("P",frame[y,x])
-            frame[x,y] = 128
-            pixels.append((y,x))
-            # N
-            if y > 0:
-                queue.append((y-1,x))
-            # S
-            if y < frame.shape[1]-1:
-                queue.append((y+1,x))
-            # W
-            if x > 0:
-                queue.append((y,x-1))
-            # E
-            if x < frame.shape[0]-1:
-                queue.append((y,x+1))
-
-    miny, minx = start_pos
-    maxy, maxx = start_pos
-    for pixel in pixels:
-        x = pixel[X_]
-        y = pixel[Y_]
-        minx = x if x < minx else minx
-        miny = y if y < miny else miny
-        maxx = x if x > maxx else maxx
-        maxy = y if y > maxy else maxy
-    for ix in range(minx,maxx):
-        for iy in range(miny,maxy):
-            frame[ix,iy] = 128
-
-    return ((miny, minx), (maxy, maxx))
+# Columns of the (N, 4) box arrays: left, top, right, bottom. right and bottom are inclusive
+BOX_X0 = 0
+BOX_Y0 = 1
+BOX_X1 = 2
+BOX_Y1 = 3
+
+# Rows of boxes compared against all the others at a time when looking for contained boxes
+CONTAINMENT_CHUNK = 1024
+
+DEFAULT_CHANGE_THRESHOLD = 5 # Percent of pixel values that must change between frames before text boxes are detected again
+DEFAULT_CHANGE_SAMPLE_STEP = 4 # The quick check compares every n-th pixel of every n-th row
+DEFAULT_CHANGE_MARGIN = 1 # Percent either side of the threshold where the quick check falls back to a full comparison
+
+DEFAULT_LAYOUT_CACHE_BYTES = 16 * 1024 * 1024 # Memory the layout cache may hold before evicting
+DEFAULT_FINGERPRINT_WIDTH = 240 # Width of the grayscale thumbnail a frame's layout fingerprint is hashed from
+FINGERPRINT_LEVELS_SHIFT = 4 # Thumbnail values are quantized to 16 levels so compression noise does not change the fingerprint
+LAYOUT_ENTRY_OVERHEAD = 128 # Approximate bytes of bookkeeping per cached layout
+
+DEFAULT_REGION_PERCENTILES = (1, 99) # Percentiles of the fixation positions that bound an inferred text region
+DEFAULT_REGION_PADDING = 100 # Pixels added around an inferred text region
 
 def is_in_box(box,coord):
     X = 0
     Y = 1
-    MIN = 0
-    MAX = 1
-    return (coord[X] >= box[MIN][X]) and (coord[X] <= box[MAX][X]) and (coord[Y] >= box[MIN][Y]) and (coord[Y] <= box[MAX][Y])
-
-
-
-def get_text_boxes(current_frame, previous_frame, boxes):
-    if previous_frame is None:
-        previous_frame = 255 - current_frame
-    res = cv2.absdiff(current_frame, previous_frame)
-    res = res.astype(np.uint8)
-    percentage = (np.count_nonzero(res) * 100) / res.size
-    if percentage > 5:
-        print(percentage)
-        
-        print("Generating new highlight data")
-        original = current_frame.copy()
-        # Process Image
-        ## Invert
-        inv = cv2.bitwise_not(original)
-        ## Gray
-        gray = cv2.cvtColor(inv,cv2.COLOR_BGR2GRAY)
-        ## Darken
-        gray = cv2.convertScaleAbs(gray,alpha=1,beta=-100)
-        ## Dilate
-        ret, thresh1 = cv2.threshold(gray,0,255,cv2.THRESH_OTSU | cv2.THRESH_BINARY_INV)
-        rect_kernel = cv2.getStructuringElement(cv2.MORPH_RECT,(20,3))
-        dilation = cv2.dilate(thresh1, rect_kernel,iterations=1)
-
-        boxes = []
-        for y in range(dilation.shape[1]):
-            for x in range(dilation.shape[0]):
-                if dilation[x][y] == 255:
-                    box = flood_fill(dilation,(y,x))
-                    boxes.append(box)
-        height_map = {}
-        # avg_height = 0
-        for box in boxes:
-            height = box[1][1] - box[0][1]
-            if height not in height_map:
-                height_map[height] = 0
-            height_map[height] += 1
-        mode_height = max(height_map,key=height_map.get)
-        rtn_boxes = []
-        for box in boxes:
-            height = box[1][1] - box[0][1]
-            if height > (mode_height / 2) and height < (mode_height * 1.5):
-                rtn_boxes.append(box)
-        boxes = rtn_boxes
+    return (coord[X] >= box[BOX_X0]) and (coord[X] <= box[BOX_X1]) and (coord[Y] >= box[BOX_Y0]) and (coord[Y] <= box[BOX_Y1])
+
+# Clips an (x0, y0, x1, y1) region, with exclusive right and bottom edges, to a frame of the given shape.
+# Returns None, meaning the whole frame, if the region is None or nothing of it is on the frame
+def clip_region(region, shape):
+    if region is None:
+        return None
+    x0, y0 = max(int(region[0]), 0), max(int(region[1]), 0)
+    x1, y1 = min(int(region[2]), shape[1]), min(int(region[3]), shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+# Returns the part of the frame inside the region (a view), or the whole frame if region is None
+def crop_region(frame, region):
+    region = clip_region(region, frame.shape)
+    if region is None:
+        return frame
+    return frame[region[1]:region[3], region[0]:region[2]]
+
+# Infers the region of the screen holding the code from where the fixations landed: the given percentiles
+# of their x and y positions, padded on every side. Leaves out taskbars, menus and side panels nobody read.
+# Returns None if there are no valid positions
+def infer_text_region(xs, ys, percentiles=DEFAULT_REGION_PERCENTILES, padding=DEFAULT_REGION_PADDING):
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    valid = np.isfinite(xs) & np.isfinite(ys)
+    if not valid.any():
+        return None
+    x0, x1 = np.percentile(xs[valid], percentiles)
+    y0, y1 = np.percentile(ys[valid], percentiles)
+    return (int(x0) - padding, int(y0) - padding, int(x1) + padding + 1, int(y1) + padding + 1)
+
+# Returns the (N, 4) boxes of the 4-connected white regions of a binary mask
+def component_boxes(mask):
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=4)
+    stats = stats[1:] # label 0 is the background
+    boxes = np.empty((count - 1, 4), dtype=np.int64)
+    boxes[:, BOX_X0] = stats[:, cv2.CC_STAT_LEFT]
+    boxes[:, BOX_Y0] = stats[:, cv2.CC_STAT_TOP]
+    boxes[:, BOX_X1] = stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH] - 1
+    boxes[:, BOX_Y1] = stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT] - 1
+    return boxes
+
+# Drops the boxes that lie inside another box, such as the dot of an i or the inside of a bracket.
+# Of identical boxes the first is kept
+def drop_contained_boxes(boxes):
+    keep = np.ones(len(boxes), dtype=bool)
+    index = np.arange(len(boxes))
+    for start in range(0, len(boxes), CONTAINMENT_CHUNK):
+        inner = boxes[start:start + CONTAINMENT_CHUNK, None, :]
+        contains = ((boxes[None, :, BOX_X0] <= inner[..., BOX_X0]) & (boxes[None, :, BOX_Y0] <= inner[..., BOX_Y0]) &
+                    (boxes[None, :, BOX_X1] >= inner[..., BOX_X1]) & (boxes[None, :, BOX_Y1] >= inner[..., BOX_Y1]))
+        same = (boxes[None, :, :] == inner).all(axis=2)
+        # A box is dropped for any other box that contains it, unless they are identical and the other comes later
+        contains &= ~same | (index[None, :] < index[start:start + CONTAINMENT_CHUNK, None])
+        keep[start:start + CONTAINMENT_CHUNK] = ~contains.any(axis=1)
+    return boxes[keep]
+
+# Keeps the boxes whose height is within half to one and a half times the most common box height
+def filter_box_heights(boxes):
+    if len(boxes) == 0:
+        return boxes
+    heights = boxes[:, BOX_Y1] - boxes[:, BOX_Y0]
+    mode_height = np.argmax(np.bincount(heights))
+    return boxes[(heights > (mode_height / 2)) & (heights < (mode_height * 1.5))]
+
+# Decides whether a frame changed enough from the previous one for its text boxes to be detected again.
+# Nearest neighbour thumbnails, taking every sample_step-th pixel, estimate the percentage of changed pixel
+# values. Only when the estimate is within margin of the threshold are the full frames compared. The last
+# thumbnail is kept, so each frame is only shrunk once. Counts how each decision was made
+class FrameChangeDetector:
+    def __init__(self, threshold=DEFAULT_CHANGE_THRESHOLD, sample_step=DEFAULT_CHANGE_SAMPLE_STEP, margin=DEFAULT_CHANGE_MARGIN):
+        self.threshold = threshold
+        self.sample_step = sample_step
+        self.margin = margin
+        self.last_frame = None
+        self.last_region = None
+        self.last_thumbnail = None
+        self.checks = 0
+        self.thumbnail_decisions = 0
+        self.full_comparisons = 0
+        self.detections = 0
+
+    # Returns the percentage of pixel values that differ between the two frames
+    def changed_percentage(self, current_frame, previous_frame):
+        return (np.count_nonzero(cv2.absdiff(current_frame, previous_frame)) * 100) / current_frame.size
+
+    def thumbnail(self, frame, region=None):
+        if frame is self.last_frame and region == self.last_region:
+            return self.last_thumbnail
+        frame = crop_region(frame, region)
+        height, width = frame.shape[:2]
+        size = (max(width // self.sample_step, 1), max(height // self.sample_step, 1))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST)
+
+    # Returns True if the text boxes of current_frame need to be detected. Always True without a previous frame.
+    # Only the part of the frames inside region (if given) is compared
+    def changed(self, current_frame, previous_frame, region=None):
+        self.checks += 1
+        current = self.thumbnail(current_frame, region)
+        if previous_frame is None or previous_frame.shape != current_frame.shape:
+            changed = True
+        else:
+            estimate = self.changed_percentage(current, self.thumbnail(previous_frame, region))
+            if abs(estimate - self.threshold) >= self.margin:
+                self.thumbnail_decisions += 1
+                changed = estimate > self.threshold
+            else:
+                self.full_comparisons += 1
+                changed = self.changed_percentage(crop_region(current_frame, region), crop_region(previous_frame, region)) > self.threshold
+        if changed:
+            self.detections += 1
+        self.last_frame, self.last_region, self.last_thumbnail = current_frame, region, current
+        return changed
+
+    # Returns a one line report of how often text boxes were detected and how the decisions were made
+    def summary(self):
+        return (f"Text boxes: detected on {self.detections} of {self.checks} frames, "
+                f"{self.thumbnail_decisions} decided by thumbnail, {self.full_comparisons} by full comparison")
+
+# Least recently used cache of the text boxes detected on frames, keyed by a fingerprint of the frame, so
+# screens that were seen before (scrolling back to the same code) reuse their boxes without detection.
+# Holds at most max_bytes of boxes, evicting the least recently used layouts first
+class LayoutCache:
+    def __init__(self, max_bytes=DEFAULT_LAYOUT_CACHE_BYTES, fingerprint_width=DEFAULT_FINGERPRINT_WIDTH):
+        self.max_bytes = max_bytes
+        self.fingerprint_width = fingerprint_width
+        self.layouts = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Returns a hash of a small quantized grayscale thumbnail of the frame, or of its region if given
+    def fingerprint(self, frame, region=None):
+        region = clip_region(region, frame.shape)
+        frame = crop_region(frame, region)
+        height, width = frame.shape[:2]
+        size = (min(self.fingerprint_width, width), max(height * min(self.fingerprint_width, width) // width, 1))
+        gray = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        digest = hashlib.blake2b(np.right_shift(gray, FINGERPRINT_LEVELS_SHIFT).tobytes(), digest_size=16)
+        digest.update(np.array(frame.shape, dtype=np.int64).tobytes())
+        if region is not None:
+            digest.update(np.array(region, dtype=np.int64).tobytes())
+        return digest.digest()
+
+    # Returns the cached boxes of the fingerprint, or None
+    def get(self, key):
+        boxes = self.layouts.get(key)
+        if boxes is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.layouts.move_to_end(key)
+        return boxes
+
+    def put(self, key, boxes):
+        if key in self.layouts:
+            self.bytes -= self.layouts.pop(key).nbytes + LAYOUT_ENTRY_OVERHEAD
+        size = boxes.nbytes + LAYOUT_ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self.layouts[key] = boxes
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self.layouts.popitem(last=False)
+            self.bytes -= evicted.nbytes + LAYOUT_ENTRY_OVERHEAD
+            self.evictions += 1
+
+    # Returns the boxes of the frame (within region, if given) from the cache, detecting and caching them on a miss
+    def text_boxes(self, frame, region=None):
+        key = self.fingerprint(frame, region)
+        boxes = self.get(key)
+        if boxes is None:
+            boxes = detect_text_boxes(frame, region)
+            self.put(key, boxes)
+        return boxes
+
+    # Returns a one line report of the cache hits, misses and size
+    def summary(self):
+        return (f"Layout cache: {self.hits} hits, {self.misses} misses, {self.evictions} evicted, "
+                f"{len(self.layouts)} layouts in {self.bytes / 1024:.1f} KiB of {self.max_bytes / 1024:.0f} KiB")
+
+# Finds the boxes around the words and lines of text on the frame, as an (N, 4) array.
+# With a region, only the part of the frame inside it is searched
+def detect_text_boxes(frame, region=None):
+    region = clip_region(region, frame.shape)
+    # Process Image
+    ## Invert
+    inv = cv2.bitwise_not(crop_region(frame, region))
+    ## Gray
+    gray = cv2.cvtColor(inv,cv2.COLOR_BGR2GRAY)
+    ## Darken
+    gray = cv2.convertScaleAbs(gray,alpha=1,beta=-100)
+    ## Dilate
+    ret, thresh1 = cv2.threshold(gray,0,255,cv2.THRESH_OTSU | cv2.THRESH_BINARY_INV)
+    rect_kernel = cv2.getStructuringElement(cv2.MORPH_RECT,(20,3))
+    dilation = cv2.dilate(thresh1, rect_kernel,iterations=1)
+
+    boxes = filter_box_heights(drop_contained_boxes(component_boxes(dilation)))
+    if region is not None:
+        boxes[:, [BOX_X0, BOX_X1]] += region[0]
+        boxes[:, [BOX_Y0, BOX_Y1]] += region[1]
+    return boxes
+
+# Returns the text boxes of the current frame: detected again if change_detector finds the frame changed
+# from the previous one, otherwise the boxes found before. Without a detector the default threshold is used.
+# With a layout_cache, frames that were seen before take their boxes from it. With a region (x0, y0, x1, y1),
+# only that part of the frame is checked for changes and searched for text
+def get_text_boxes(current_frame, previous_frame, boxes, change_detector=None, layout_cache=None, region=None):
+    if change_detector is None:
+        change_detector = FrameChangeDetector()
+    if change_detector.changed(current_frame, previous_frame, region) or boxes is None:
+        if layout_cache is not None:
+            boxes = layout_cache.text_boxes(current_frame, region)
+        else:
+            boxes = detect_text_boxes(current_frame, region)
     return boxes
 
+# Index of text boxes for finding the boxes under a point in O(log n).
+# Boxes are sorted by their top edge. Any box containing a point starts at most the tallest box height
+# above it, so a binary search narrows the candidates to that band of tops
+class BoxIndex:
+    def __init__(self, boxes):
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        self.boxes = boxes
+        self.order = np.argsort(boxes[:, BOX_Y0], kind="stable")
+        self.sorted_boxes = boxes[self.order]
+        self.tops = self.sorted_boxes[:, BOX_Y0]
+        self.max_height = int((boxes[:, BOX_Y1] - boxes[:, BOX_Y0]).max()) if len(boxes) != 0 else 0
+
+    def __len__(self):
+        return len(self.boxes)
+
+    # Returns the boxes containing the point (edges included), in their original order
+    def find(self, x, y):
+        if len(self.boxes) == 0 or not (np.isfinite(x) and np.isfinite(y)):
+            return self.boxes[:0]
+        lo = int(np.searchsorted(self.tops, y - self.max_height, 'left'))
+        hi = int(np.searchsorted(self.tops, y, 'right'))
+        candidates = self.sorted_boxes[lo:hi]
+        inside = (candidates[:, BOX_X0] <= x) & (candidates[:, BOX_X1] >= x) & (candidates[:, BOX_Y1] >= y)
+        return self.boxes[np.sort(self.order[lo:hi][inside])]
+
+# Blends the color at 50% over the boxes containing the fixation (in place). boxes is a BoxIndex or an
+# (N, 4) box array. The right and bottom edges of a box are not blended
 def highlight_frame(frame,boxes,fixation,color):
-    for box in boxes:
-        # For now, highlight them all
-        start = (box[0][0],box[0][1])
-        end = (box[1][0],box[1][1])
-        if(is_in_box(box,(fixation.x,fixation.y))):
-            for x in range(box[0][0],box[1][0]):
-                for y in range(box[0][1],box[1][1]):
-                    b = frame[int(y), int(x), 0] * (50) / 100  + color[0] * 50 / 100 # get B value
-                    g = frame[int(y), int(x), 1] * (50) / 100  + color[1] * 50 / 100 # get B value
-                    r = frame[int(y), int(x), 2] * (50) / 100  + color[2] * 50 / 100 # get B value
-                    frame[y,x] = (b,g,r)
-            #frame = cv2.rectangle(frame,start,end,(random.randint(0,255),random.randint(0,255),random.randint(0,255)),3)
+    highlight_point(frame, boxes, fixation.x, fixation.y, color)
+
+# Blends the color at 50% over the boxes containing the point (x, y) (in place), as highlight_frame
+def highlight_point(frame,boxes,x,y,color):
+    if not isinstance(boxes, BoxIndex):
+        boxes = BoxIndex(boxes)
+    color = np.asarray(color, dtype=np.uint16)
+    for box in boxes.find(x, y):
+        roi = frame[box[BOX_Y0]:box[BOX_Y1], box[BOX_X0]:box[BOX_X1]]
+        # Half of each, rounded down
+        roi[:] = (roi + color) // 2
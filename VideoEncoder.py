@@ -0,0 +1,191 @@
+import argparse
+import cv2
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Fourcc OpenCV writes for each container when none is given
+CONTAINER_FOURCCS = {".avi": "XVID", ".mkv": "XVID", ".mp4": "mp4v", ".mov": "mp4v", ".m4v": "mp4v"}
+DEFAULT_FOURCC = "XVID"
+LOSSLESS_FOURCC = "FFV1" # Lossless codec OpenCV can write, for intermediate files
+LOSSLESS_EXTENSION = ".avi"
+
+DEFAULT_FFMPEG_CODEC = "libx264"
+DEFAULT_PRESET = "veryfast"
+DEFAULT_CRF = 23
+DEFAULT_ENCODE_THREADS = 0 # Let ffmpeg choose
+
+ENCODER_BACKENDS = ("opencv", "ffmpeg")
+DEFAULT_BENCHMARK_FRAMES = 150
+
+# Returns the fourcc OpenCV uses for a file by default, chosen by its extension
+def DefaultFourcc(file_name):
+    return CONTAINER_FOURCCS.get(os.path.splitext(file_name)[1].lower(), DEFAULT_FOURCC)
+
+# Writes frames with an OpenCV VideoWriter
+class OpenCVEncoder:
+    def __init__(self, file_name, fps, size, fourcc=None):
+        self.fourcc = fourcc or DefaultFourcc(file_name)
+        self.writer = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*self.fourcc), fps, size)
+        if not self.writer.isOpened():
+            raise IOError(f"OpenCV cannot write {self.fourcc} to {file_name}")
+
+    def write(self, img):
+        self.writer.write(img)
+
+    def release(self):
+        self.writer.release()
+
+# Writes frames by piping raw BGR frames to a local ffmpeg process, which encodes them with codec at preset/CRF
+# using threads threads (0 lets ffmpeg choose). Uses far fewer bits than OpenCV's MPEG-4 encoders for the same quality
+class FFmpegEncoder:
+    def __init__(self, file_name, fps, size, codec=DEFAULT_FFMPEG_CODEC, preset=DEFAULT_PRESET, crf=DEFAULT_CRF, threads=DEFAULT_ENCODE_THREADS):
+        if not shutil.which("ffmpeg"):
+            raise IOError("ffmpeg was not found on the PATH")
+        self.file_name = file_name
+        self.size = size
+        command = ["ffmpeg", "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+                   "-c:v", codec, "-threads", str(threads)]
+        if codec in ("libx264", "libx265"):
+            command += ["-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
+        elif codec == "ffv1":
+            command += ["-level", "3"]
+        self.process = subprocess.Popen(command + [file_name], stdin=subprocess.PIPE)
+
+    def write(self, img):
+        if img.shape[1] != self.size[0] or img.shape[0] != self.size[1]:
+            raise ValueError(f"Frame of size {img.shape[1]}x{img.shape[0]} written to a {self.size[0]}x{self.size[1]} video")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(img).data)
+        except BrokenPipeError:
+            raise IOError(f"ffmpeg stopped while writing {self.file_name}") from None
+
+    def release(self):
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise IOError(f"ffmpeg failed writing {self.file_name}")
+
+# How output videos are encoded: the backend ("opencv" or "ffmpeg") and its settings.
+# Picklable, so worker processes open their encoders from the same settings
+class EncoderSettings:
+    def __init__(self, backend="opencv", fourcc=None, codec=DEFAULT_FFMPEG_CODEC, preset=DEFAULT_PRESET, crf=DEFAULT_CRF, threads=DEFAULT_ENCODE_THREADS):
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend {backend}, expected one of {', '.join(ENCODER_BACKENDS)}")
+        self.backend = backend
+        self.fourcc = fourcc
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+
+    # Settings for lossless intermediate files, such as the segments of a parallel render, which are
+    # encoded once more when joined
+    @classmethod
+    def lossless(cls):
+        return cls("opencv", LOSSLESS_FOURCC)
+
+    # True when the settings write lossless video
+    def is_lossless(self):
+        if self.backend == "opencv":
+            return self.fourcc == LOSSLESS_FOURCC
+        return self.codec == "ffv1"
+
+    # Returns an encoder writing file_name with these settings
+    def open(self, file_name, fps, size):
+        if self.backend == "ffmpeg":
+            return FFmpegEncoder(file_name, fps, size, self.codec, self.preset, self.crf, self.threads)
+        return OpenCVEncoder(file_name, fps, size, self.fourcc)
+
+    def __str__(self):
+        if self.backend == "ffmpeg":
+            return f"ffmpeg {self.codec} preset={self.preset} crf={self.crf} threads={self.threads}"
+        return f"opencv {self.fourcc or 'by extension'}"
+
+
+# Returns the frames benchmarks encode: the first frames of video_path, or synthetic screen-like frames of size
+def _BenchmarkFrames(video_path, size, count):
+    frames = []
+    if video_path is not None:
+        video = cv2.VideoCapture(video_path)
+        while len(frames) < count:
+            ret, img = video.read()
+            if not ret:
+                break
+            frames.append(img)
+        video.release()
+        if len(frames) != 0:
+            return frames
+    # Light background with lines of "text" scrolling, and a moving gaze blob
+    width, height = size
+    base = np.full((height, width, 3), 235, dtype=np.uint8)
+    rng = np.random.default_rng(0)
+    for y in range(20, height - 20, 20):
+        x1 = int(rng.integers(width // 4, width - 20))
+        base[y:y+8, 40:x1] = rng.integers(0, 120, 3)
+    for i in range(count):
+        img = np.roll(base, -(i // 10) * 20, axis=0)
+        cv2.circle(img, ((i * 7) % width, height // 2), 20, (255, 255, 0), -1)
+        frames.append(img)
+    return frames
+
+# Encodes the same frames with each of the settings and returns a list of
+# (settings, frames per second, bytes per frame) results. Settings that cannot be opened are skipped
+def BenchmarkEncoders(settings_list, video_path=None, size=(1920, 1080), frames=DEFAULT_BENCHMARK_FRAMES, fps=30):
+    images = _BenchmarkFrames(video_path, size, frames)
+    size = (images[0].shape[1], images[0].shape[0])
+    results = []
+    temp_dir = tempfile.mkdtemp(prefix="itrace-encode-")
+    try:
+        for i, settings in enumerate(settings_list):
+            file_name = os.path.join(temp_dir, f"bench{i}" + (".mkv" if settings.backend == "ffmpeg" else ".avi"))
+            try:
+                start = time.time()
+                encoder = settings.open(file_name, fps, size)
+                for img in images:
+                    encoder.write(img)
+                encoder.release()
+                elapsed = time.time() - start
+            except IOError as e:
+                print("Skipping", settings, "-", e)
+                continue
+            results.append((settings, len(images) / elapsed, os.path.getsize(file_name) / len(images)))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return results
+
+# Returns the settings benchmarked by default: OpenCV's MPEG-4 and lossless writers, and x264 at a few presets when ffmpeg is available
+def DefaultBenchmarkSettings(threads=DEFAULT_ENCODE_THREADS):
+    settings = [EncoderSettings("opencv", "XVID"), EncoderSettings("opencv", "mp4v"), EncoderSettings.lossless()]
+    if shutil.which("ffmpeg"):
+        for preset in ("ultrafast", "veryfast", "medium"):
+            settings.append(EncoderSettings("ffmpeg", preset=preset, threads=threads))
+        settings.append(EncoderSettings("ffmpeg", codec="ffv1", threads=threads))
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the video encoders available on this machine")
+    parser.add_argument("--video", default=None, help="Encode the first frames of this video instead of synthetic frames")
+    parser.add_argument("--size", default="1920x1080", help="Size of the synthetic frames, as WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, default=DEFAULT_BENCHMARK_FRAMES, help="Frames to encode with each encoder")
+    parser.add_argument("--threads", type=int, default=DEFAULT_ENCODE_THREADS, help="ffmpeg encoder threads (0 lets ffmpeg choose)")
+    args = parser.parse_args(argv)
+
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg not found, only benchmarking the OpenCV encoders")
+    for settings, fps, frame_bytes in BenchmarkEncoders(DefaultBenchmarkSettings(args.threads), args.video, size, args.frames):
+        print(f"{str(settings):<55} {fps:8.1f} frames/s {frame_bytes / 1024:10.1f} KiB/frame")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,960 @@
+import argparse
+import cv2
+import numpy as np
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import multiprocessing
+import threading
+
+from iTraceDB import iTraceDB
+from EyeDataTypes import GazeArray, FixationArray, ConvertWindowsTime, ConvertUnixTime, DEFAULT_BATCH_SIZE
+from FramePipeline import FramePipeline, DEFAULT_QUEUE_SIZE
+from OverlayRenderer import Overlay, polyline_mask
+from VideoEncoder import EncoderSettings, ENCODER_BACKENDS, LOSSLESS_EXTENSION, DEFAULT_PRESET, DEFAULT_CRF, DEFAULT_ENCODE_THREADS, DEFAULT_FFMPEG_CODEC
+from TextDetector import get_text_boxes, highlight_point, infer_text_region, BoxIndex, FrameChangeDetector, LayoutCache, DEFAULT_CHANGE_THRESHOLD, DEFAULT_LAYOUT_CACHE_BYTES
+
+DEFAULT_ROLLING_WIN_SIZE = 1000 # Size of rolling window in miliseconds
+DEFAULT_GAZE_RADIUS = 5
+DEFAULT_FIXATION_RADIUS = 5
+DEFAULT_VID_SCALE = 1 # INCREASING THIS CAUSES THE VIDEO TO BECOME MUCH LONGER, AND HAVE MUCH MORE DETAIL
+DEFAULT_SEGMENTS_PER_PROCESS = 4 # More segments than processes keeps every core busy until the end
+DEFAULT_STREAM_BLOCK = 10000 # Miliseconds of data a streaming renderer loads ahead at a time
+DRAFT_SCALE = 0.5 # Frame size of draft renders, relative to the video
+DRAFT_FPS = 10 # Frame rate draft renders keep at most
+DEFAULT_PREVIEW_BUFFER = 32 # Drawn frames a preview keeps around the current one for stepping back and forth
+
+# Converts color string (rgb) to color tuple (bgr)
+def ConvertColorStringToTuple(color: "#XXXXXX") -> tuple[int]:
+    color = color[1:]
+    b = int(color[4:6],base=16)
+    g = int(color[2:4],base=16)
+    r = int(color[0:2],base=16)
+    return (b,g,r)
+
+# converts color tuple (bgr) to color string (rgb)
+def ConvertColorTupleToString(color: tuple[int]) -> "#XXXXXX":
+    return "#"+str(hex(color[2]))[2:].zfill(2)+str(hex(color[1]))[2:].zfill(2)+str(hex(color[0]))[2:].zfill(2)
+
+# Parses a text region option: "auto", or "x0,y0,x1,y1" in pixels. Returns None for an empty string
+def ParseTextRegion(text):
+    if text is None or text.strip() == "":
+        return None
+    if text.strip().lower() == "auto":
+        return "auto"
+    values = [int(value) for value in text.split(",")]
+    if len(values) != 4:
+        raise ValueError(f"Text region must be auto or x0,y0,x1,y1, not {text}")
+    return tuple(values)
+
+# Takes the GazeArray and the system times of the gazes that belong to fixations and figures out the saccades
+# Saccades are defined as the group of gazes between two consecutive fixations. NaN gazes are skipped but do not
+# split a saccade. Returns an (N, 2) array of [start, end) index ranges into the gaze arrays
+def GetSaccadeRanges(gazes, fixation_gaze_times):
+    return _GroupSaccades(np.isin(gazes.system_time, fixation_gaze_times), gazes.nan)
+
+# Groups the gazes that are neither in a fixation nor NaN into saccade index ranges
+def _GroupSaccades(in_fixation, nan):
+    saccade_gazes = np.flatnonzero(~in_fixation & ~nan)
+    if len(saccade_gazes) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    # Gazes between the same two fixation gazes share a group number
+    group = np.cumsum(in_fixation)[saccade_gazes]
+    new_group = group[1:] != group[:-1]
+    starts = saccade_gazes[np.concatenate(([True], new_group))]
+    ends = saccade_gazes[np.concatenate((new_group, [True]))] + 1
+    return np.stack((starts, ends), axis=1)
+
+# Converts the x/y columns of a GazeArray or FixationArray to integer pixel coordinates in a frame scaled by scale, zero where NaN
+def GetDrawPoints(items, scale=1):
+    valid = ~(np.isnan(items.x) | np.isnan(items.y))
+    points = np.zeros((len(items), 2), dtype=np.int64)
+    points[valid, 0] = items.x[valid] * scale
+    points[valid, 1] = items.y[valid] * scale
+    return points, valid
+
+# Returns the frame step that brings a video's fps down to at most max_fps
+def DraftFrameStep(fps, max_fps=DRAFT_FPS):
+    return max(1, int(np.ceil(fps / max_fps)))
+
+
+# Loads the gazes of a session, and the fixations and saccades of one of its fixation runs, from the database
+def LoadSessionData(idb, session_id, fixation_run_id=None, saccades=True):
+    t = time.time()
+    print("Gathering Gazes, ",end="")
+    gazes = idb.GetSessionGazeArray(session_id)
+    print("Len:",len(gazes),"Elapsed:",time.time()-t)
+
+    fixations = None
+    if fixation_run_id is not None:
+        t = time.time()
+        print("Gathering Fixations, ",end="")
+        fixations = idb.GetRunFixationArray(fixation_run_id)
+        print("Len:",len(fixations),"Elapsed:",time.time()-t)
+
+    if saccades and fixations is not None:
+        t = time.time()
+        print("Gathering Saccades, ",end="")
+        saccades = GetSaccadeRanges(gazes, idb.GetRunFixationGazes(fixation_run_id).system_time)
+        print("Len:",len(saccades),"Elapsed:",time.time()-t)
+    else:
+        saccades = None
+
+    return gazes, fixations, saccades
+
+# Opens streams over the gazes of a session, and the fixations and saccades of one of its fixation runs,
+# which a renderer loads from as it draws instead of loading the whole session up front.
+# With a start_time (system time in ms) the streams skip, in the database, the rows that drawing from
+# start_time on with the rolling window size never looks at
+def LoadSessionStream(idb, session_id, fixation_run_id=None, saccades=True, batch_size=DEFAULT_BATCH_SIZE, start_time=None, rolling_win_size=DEFAULT_ROLLING_WIN_SIZE):
+    gaze_start = None
+    fixation_start = None
+    if start_time is not None:
+        gaze_start, fixation_start = GetStreamStartTimes(idb, session_id, fixation_run_id, saccades, start_time - rolling_win_size)
+
+    fixation_chunks = None
+    fixation_gaze_chunks = None
+    fixation_positions = None
+    if fixation_run_id is not None:
+        fixation_chunks = idb.IterRunFixations(fixation_run_id, batch_size, fixation_start)
+        fixation_positions = idb.GetRunFixationPositions(fixation_run_id, batch_size)
+        if saccades:
+            fixation_gaze_chunks = idb.IterRunFixationGazes(fixation_run_id, batch_size, gaze_start)
+    return SessionStream(idb.IterSessionGazes(session_id, batch_size, gaze_start), fixation_chunks, fixation_gaze_chunks, fixation_positions,
+                         lambda start_time: idb.IterSessionGazes(session_id, batch_size, start_time))
+
+# Returns the earliest gaze system time and fixation start event time a stream needs to draw from the rolling
+# window starting at begin, as the same windows a stream from the session start would hand out there.
+# Saccades are grouped from the last fixation gaze before begin, the last gaze and fixation are always kept,
+# and a fixation still showing at begin started at most the longest fixation duration before it
+def GetStreamStartTimes(idb, session_id, fixation_run_id, saccades, begin):
+    last_gaze = idb.GetSessionEndTime(session_id)
+    if last_gaze is None:
+        return None, None
+    gaze_start = begin
+    if fixation_run_id is not None and saccades:
+        gaze_start = idb.GetRunFixationGazeTimeBefore(fixation_run_id, begin)
+    if gaze_start is not None:
+        gaze_start = min(gaze_start, last_gaze)
+
+    fixation_start = None
+    if fixation_run_id is not None:
+        longest, last_fixation = idb.GetRunFixationExtents(fixation_run_id)
+        if last_fixation is not None:
+            # One millisecond to spare for the rounding of the time conversion
+            fixation_start = min(int(ConvertUnixTime(begin - (longest or 0) - 1)), last_fixation)
+    return gaze_start, fixation_start
+
+
+# The saccade after a fixation run's last fixation gaze, which runs to the end of the session. A SessionStream hands
+# it out in place of its gazes, so they are never all held at once: read_gazes(start_time) returns an iterator of
+# GazeArray chunks of the session from start_time on, which is read through here to find the saccade's last gaze,
+# and again by the renderer to draw its line. start_time and end_time are the times of its first and last gazes
+class OpenSaccade:
+    def __init__(self, read_gazes, start_time):
+        self.read_gazes = read_gazes
+        self.start_time = start_time
+        self.end_time = start_time
+        for chunk in self.chunks():
+            self.end_time = int(chunk.system_time[-1])
+
+    # Yields the saccade's gazes that are not NaN, as GazeArrays
+    def chunks(self):
+        for chunk in self.read_gazes(self.start_time):
+            chunk = chunk[~chunk.nan]
+            if len(chunk) != 0:
+                yield chunk
+
+
+# Time ordered session data read from iterators of GazeArray, FixationArray and FixationGazeArray chunks
+# (such as iTraceDB.IterSessionGazes). window() hands out the data for one span of time, reading chunks
+# only as far as that span needs and dropping the rows before it, so the memory used depends on the
+# span and the chunk size rather than the length of the session. Windows must move forward in time.
+# fixation_positions optionally holds the positions of every fixation, for inferring the text region.
+# read_gazes(start_time) optionally reopens the gazes from start_time on, which lets the saccade after the
+# last fixation gaze be handed out as an OpenSaccade. Without it that saccade's gazes are all buffered
+class SessionStream:
+    def __init__(self, gaze_chunks, fixation_chunks=None, fixation_gaze_chunks=None, fixation_positions=None, read_gazes=None):
+        self.gaze_chunks = iter(gaze_chunks)
+        self.fixation_chunks = iter(fixation_chunks) if fixation_chunks is not None else iter(())
+        self.fixation_gaze_chunks = iter(fixation_gaze_chunks) if fixation_gaze_chunks is not None else None
+        self.saccades = fixation_gaze_chunks is not None
+        self.fixation_positions = fixation_positions
+        self.read_gazes = read_gazes
+
+        self.gazes = GazeArray.from_rows([])
+        self.in_fixation = np.zeros(0, dtype=bool)
+        self.fixations = FixationArray.from_rows([])
+        self.fixation_end_times = np.empty(0)
+        # Fixation gaze times read ahead of the gazes
+        self.fixation_gaze_times = np.empty(0, dtype=np.int64)
+        # Time of the latest fixation gaze read. Once they are all read, the gazes after it are one open saccade
+        self.last_fixation_gaze_time = None
+        self.open_saccade = None
+        self.gazes_done = False
+        self.fixations_done = False
+        self.fixation_gazes_done = not self.saccades
+
+    def _read_gazes(self):
+        chunk = next(self.gaze_chunks, None)
+        if chunk is None:
+            self.gazes_done = True
+            return
+        if len(chunk) == 0:
+            return
+        in_fixation = np.zeros(len(chunk), dtype=bool)
+        if self.saccades:
+            # Read fixation gaze times up to the end of the chunk to know which of its gazes are in fixations
+            last = chunk.system_time[-1]
+            while not self.fixation_gazes_done and (len(self.fixation_gaze_times) == 0 or self.fixation_gaze_times[-1] <= last):
+                fixation_gazes = next(self.fixation_gaze_chunks, None)
+                if fixation_gazes is None:
+                    self.fixation_gazes_done = True
+                elif len(fixation_gazes) != 0:
+                    self.fixation_gaze_times = np.concatenate((self.fixation_gaze_times, fixation_gazes.system_time))
+                    self.last_fixation_gaze_time = max(int(fixation_gazes.system_time.max()), self.last_fixation_gaze_time or 0)
+            in_fixation = np.isin(chunk.system_time, self.fixation_gaze_times)
+            self.fixation_gaze_times = self.fixation_gaze_times[self.fixation_gaze_times >= last]
+        self.gazes = GazeArray.concatenate([self.gazes, chunk])
+        self.in_fixation = np.concatenate((self.in_fixation, in_fixation))
+
+    def _read_fixations(self):
+        chunk = next(self.fixation_chunks, None)
+        if chunk is None:
+            self.fixations_done = True
+            return
+        self.fixations = FixationArray.concatenate([self.fixations, chunk])
+        self.fixation_end_times = np.concatenate((self.fixation_end_times, ConvertWindowsTime(chunk.fixation_start_event_time) + chunk.duration))
+
+    # Index of the first buffered gaze after the last fixation gaze of the run, or the number of buffered gazes
+    # while fixation gazes may still follow
+    def _open_from(self):
+        if not self.fixation_gazes_done:
+            return len(self.gazes)
+        if self.last_fixation_gaze_time is None:
+            return 0
+        return int(np.searchsorted(self.gazes.system_time, self.last_fixation_gaze_time, 'right'))
+
+    # True once the buffered gazes include one past end and, with saccades, the whole first saccade ending after end.
+    # Past the last fixation gaze the open saccade is read on its own, so there one gaze past end is enough
+    def _gazes_past(self, end):
+        times = self.gazes.system_time
+        if len(times) == 0 or times[-1] <= end:
+            return False
+        if not self.saccades or (self.read_gazes is not None and self._open_from() < len(times)):
+            return True
+        later = np.flatnonzero((times > end) & ~self.in_fixation & ~self.gazes.nan)
+        return len(later) != 0 and bool(self.in_fixation[later[0]:].any())
+
+    # Returns (gazes, fixations, saccades, open_saccade) holding the data needed to draw timestamps from begin + the
+    # rolling window size to end, the same data GazeVideoRenderer.slice keeps. begin is the start of the rolling window.
+    # Once the saccade after the run's last fixation gaze has started it is the OpenSaccade, and is left out of saccades
+    def window(self, begin, end):
+        while not self.gazes_done and not self._gazes_past(end):
+            self._read_gazes()
+        while not self.fixations_done and not (self.fixation_end_times > end).any():
+            self._read_fixations()
+
+        times = self.gazes.system_time
+        g0, g1 = min(int(np.searchsorted(times, begin, 'right')), max(len(times) - 1, 0)), int(np.searchsorted(times, end, 'right')) + 1
+        f0 = min(int(np.searchsorted(self.fixation_end_times, begin, 'right')), max(len(self.fixations) - 1, 0))
+        f1 = int(np.searchsorted(self.fixation_end_times, end, 'right')) + 1
+
+        saccades = None
+        keep_from = g0
+        if self.saccades:
+            ranges = _GroupSaccades(self.in_fixation, self.gazes.nan)
+            open_from = self._open_from()
+            if self.read_gazes is not None and len(ranges) != 0 and ranges[-1, 0] >= open_from:
+                if self.open_saccade is None:
+                    self.open_saccade = OpenSaccade(self.read_gazes, int(times[ranges[-1, 0]]))
+                ranges = ranges[:-1]
+            end_times = times[ranges[:, 1] - 1]
+            saccades = ranges[int(np.searchsorted(end_times, begin, 'right')):int(np.searchsorted(end_times, end, 'right')) + 1]
+            if len(saccades) != 0:
+                g0, g1 = min(g0, int(saccades[0, 0])), max(g1, int(saccades[-1, 1]))
+            saccades = saccades - g0
+            # Keep from the last fixation gaze before the window, so the saccade running into the next window is found whole
+            fixation_gazes = np.flatnonzero(self.in_fixation[:g0 + 1])
+            keep_from = int(fixation_gazes[-1]) if len(fixation_gazes) != 0 else 0
+            if self.open_saccade is not None and open_from <= keep_from + 1:
+                keep_from = g0
+
+        gazes, fixations = self.gazes[g0:g1], self.fixations[f0:f1]
+        self.gazes, self.in_fixation = self.gazes[keep_from:], self.in_fixation[keep_from:]
+        self.fixations, self.fixation_end_times = self.fixations[f0:], self.fixation_end_times[f0:]
+        return gazes, fixations, saccades, self.open_saccade
+
+
+# Index ranges into a renderer's gaze, fixation and saccade arrays for each of a list of timestamps, found
+# with binary searches over the renderer's time keys in one pass. For each timestamp:
+#   gaze_begin, gaze_end - the gazes drawn, from the start of the rolling window to the first gaze after the timestamp
+#   fixation_begin, fixation_end - the fading fixations. fixation_end is also the current fixation, or -1 without fixations
+#   saccade - the saccade ending after the timestamp, or -1 once there are none left
+# Every frame can be drawn from its own entry, in any order, without stepping through the ones before it
+class FrameIndex:
+    def __init__(self, renderer, timestamps):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        begins = timestamps - renderer.ROLLING_WIN_SIZE
+
+        gaze_count = len(renderer.gaze_keys)
+        self.gaze_end = np.zeros(len(timestamps), dtype=np.int64)
+        self.gaze_begin = np.zeros(len(timestamps), dtype=np.int64)
+        if gaze_count != 0:
+            current = np.minimum(np.searchsorted(renderer.gaze_keys, timestamps, 'right'), gaze_count - 1)
+            self.gaze_begin = np.minimum(np.searchsorted(renderer.gaze_keys, begins, 'right'), current)
+            self.gaze_end = current + 1
+
+        fixation_count = len(renderer.fixation_keys)
+        self.fixation_end = np.minimum(np.searchsorted(renderer.fixation_keys, timestamps, 'right'), fixation_count - 1)
+        self.fixation_begin = np.minimum(np.searchsorted(renderer.fixation_keys, begins, 'right'), fixation_count - 1)
+
+        self.saccade = np.searchsorted(renderer.saccade_keys, timestamps, 'right')
+        self.saccade[self.saccade == len(renderer.saccade_keys)] = -1
+
+    def __len__(self):
+        return len(self.gaze_end)
+
+    # Returns (gaze_begin, gaze_end, fixation_begin, fixation_end, saccade) for the i-th timestamp
+    def frame(self, i):
+        return (int(self.gaze_begin[i]), int(self.gaze_end[i]), int(self.fixation_begin[i]), int(self.fixation_end[i]), int(self.saccade[i]))
+
+
+# Draws the gaze cloud overlay for a session onto frames of its screen recording.
+# Holds no Qt state, so it can be pickled and sent to worker processes.
+class GazeVideoRenderer:
+    def __init__(self, gazes, fixations=None, saccades=None, session_start_time=0,
+                 rolling_win_size=DEFAULT_ROLLING_WIN_SIZE, gaze_radius=DEFAULT_GAZE_RADIUS,
+                 fixation_radius=DEFAULT_FIXATION_RADIUS, vid_scale=DEFAULT_VID_SCALE, highlight=True,
+                 gaze_color=(255,255,0), saccade_color=(255,255,255), fixation_color=(0,0,255), highlight_color=(255,0,0),
+                 change_threshold=DEFAULT_CHANGE_THRESHOLD, layout_cache_bytes=DEFAULT_LAYOUT_CACHE_BYTES, text_region=None,
+                 draw_scale=1):
+        self.session_start_time = session_start_time
+        # Size of the frames drawn on relative to the video, below 1 for draft renders. Coordinates and radii are scaled to match
+        self.draw_scale = draw_scale
+
+        self.ROLLING_WIN_SIZE = rolling_win_size
+        self.GAZE_RADIUS = gaze_radius
+        self.FIXATION_RADIUS = fixation_radius
+        self.VID_SCALE = vid_scale
+        self.highlight = highlight
+
+        self.gazeColor = gaze_color
+        self.saccadeColor = saccade_color
+        self.fixationColor = fixation_color
+        self.highlightColor = highlight_color
+        # Decides when the text boxes used for highlighting are detected again
+        self.change_detector = FrameChangeDetector(change_threshold)
+        # Text boxes of screens seen before
+        self.layout_cache = LayoutCache(layout_cache_bytes)
+
+        self.stream = None
+        self.stream_block = DEFAULT_STREAM_BLOCK
+        self.window_end = None
+        self.open_saccade = None
+        self.open_saccade_line = None
+        self.set_data(gazes, fixations, saccades)
+        # Part of the screen searched for text: None for all of it, (x0, y0, x1, y1), or "auto" to infer it from the fixations
+        self.text_region = text_region
+        if text_region == "auto":
+            self.text_region = infer_text_region(self.fixations.x, self.fixations.y)
+        self.draw_text_region = self.text_region
+        if self.text_region is not None and draw_scale != 1:
+            self.draw_text_region = tuple(int(v * draw_scale) for v in self.text_region)
+        self.overlay = Overlay()
+        self.seek(session_start_time)
+
+    # Builds a renderer that reads its data from a SessionStream as drawing advances, stream_block
+    # miliseconds at a time, instead of holding the whole session. It can only draw forward in time,
+    # and cannot be sliced or sent to worker processes
+    @classmethod
+    def from_stream(cls, stream, session_start_time=0, stream_block=DEFAULT_STREAM_BLOCK, **options):
+        if options.get("text_region") == "auto":
+            positions = stream.fixation_positions
+            options["text_region"] = infer_text_region(positions.x, positions.y) if positions is not None else None
+        renderer = cls(GazeArray.from_rows([]), session_start_time=session_start_time, **options)
+        renderer.stream = stream
+        renderer.stream_block = stream_block
+        renderer.seek(session_start_time)
+        return renderer
+
+    # Replaces the data drawn from. A stream's OpenSaccade is drawn as the saccade after the last of saccades
+    def set_data(self, gazes, fixations=None, saccades=None, open_saccade=None):
+        if open_saccade is not self.open_saccade:
+            self.open_saccade = open_saccade
+            self.open_saccade_line = None
+        self.gazes = gazes
+        self.fixations = fixations if fixations is not None else FixationArray.from_rows([])
+        self.saccades = saccades if saccades is not None else np.empty((0, 2), dtype=np.int64)
+
+        # Time keys used to find positions in the data
+        self.gaze_times = self.gazes.system_time
+        self.fixation_start_times = ConvertWindowsTime(self.fixations.fixation_start_event_time)
+        self.fixation_end_times = self.fixation_start_times + self.fixations.duration
+        self.saccade_start_times = self.gaze_times[self.saccades[:, 0]]
+        self.saccade_end_times = self.gaze_times[self.saccades[:, 1] - 1]
+        if open_saccade is not None:
+            self.saccade_start_times = np.append(self.saccade_start_times, open_saccade.start_time)
+            self.saccade_end_times = np.append(self.saccade_end_times, open_saccade.end_time)
+        # Running maximums of the end times searched by FrameIndex. Equal to the times when they are in order,
+        # and otherwise hold the position a cursor stepping past every ended item would reach
+        self.gaze_keys = np.maximum.accumulate(self.gaze_times) if len(self.gaze_times) != 0 else self.gaze_times
+        self.fixation_keys = np.maximum.accumulate(self.fixation_end_times) if len(self.fixation_end_times) != 0 else self.fixation_end_times
+        self.saccade_keys = np.maximum.accumulate(self.saccade_end_times) if len(self.saccade_end_times) != 0 else self.saccade_end_times
+
+        self.gaze_points, self.gaze_valid = GetDrawPoints(self.gazes, self.draw_scale)
+        self.fixation_points, self.fixation_valid = GetDrawPoints(self.fixations, self.draw_scale)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["overlay"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.overlay = Overlay()
+
+    # Returns a renderer holding only the data needed to draw timestamps between start and end
+    def slice(self, start, end):
+        if self.stream is not None:
+            raise ValueError("A streaming renderer cannot be sliced")
+        begin = start - self.ROLLING_WIN_SIZE
+        # One extra item past the end, as drawing looks at the first item after the timestamp
+        g0, g1 = int(np.searchsorted(self.gaze_times, begin, 'right')), int(np.searchsorted(self.gaze_times, end, 'right')) + 1
+        f0, f1 = int(np.searchsorted(self.fixation_end_times, begin, 'right')), int(np.searchsorted(self.fixation_end_times, end, 'right')) + 1
+        s0, s1 = int(np.searchsorted(self.saccade_end_times, begin, 'right')), int(np.searchsorted(self.saccade_end_times, end, 'right')) + 1
+        # Keep the last gaze and fixation, which stay drawn once the data runs out
+        g0 = min(g0, max(len(self.gazes) - 1, 0))
+        f0 = min(f0, max(len(self.fixations) - 1, 0))
+        # Keep every gaze of the saccades in the slice
+        saccades = self.saccades[s0:s1]
+        if len(saccades) != 0:
+            g0, g1 = min(g0, int(saccades[0, 0])), max(g1, int(saccades[-1, 1]))
+        return GazeVideoRenderer(self.gazes[g0:g1], self.fixations[f0:f1], saccades - g0, self.session_start_time,
+                                 self.ROLLING_WIN_SIZE, self.GAZE_RADIUS, self.FIXATION_RADIUS, self.VID_SCALE, self.highlight,
+                                 self.gazeColor, self.saccadeColor, self.fixationColor, self.highlightColor,
+                                 self.change_detector.threshold, self.layout_cache.max_bytes, self.text_region, self.draw_scale)
+
+    # Prepares to draw frames from the timestamp on, after a jump: a stream loads its window there, and
+    # text boxes are detected again on the next frame
+    def seek(self, timestamp):
+        if self.stream is not None:
+            self.set_data(*self.stream.window(timestamp - self.ROLLING_WIN_SIZE, timestamp + self.stream_block))
+            self.window_end = timestamp + self.stream_block
+        self.prev_img = None
+        self.boxes = None
+        self.box_index = None
+
+    # Returns a video frame resized to the size drawn on
+    def prepare_frame(self, img):
+        if self.draw_scale == 1:
+            return img
+        return cv2.resize(img, self.frame_size(img.shape[1], img.shape[0]), interpolation=cv2.INTER_AREA)
+
+    # Returns the (width, height) of the frames drawn on for a video of width x height. Scaled sizes are rounded
+    # down to even numbers, which encoders writing 4:2:0 video (such as x264) require
+    def frame_size(self, width, height):
+        if self.draw_scale == 1:
+            return width, height
+        return max(int(width * self.draw_scale) // 2 * 2, 2), max(int(height * self.draw_scale) // 2 * 2, 2)
+
+    # Returns a size in pixels of the video scaled to the frames drawn on, at least one pixel
+    def draw_size(self, size):
+        if self.draw_scale == 1:
+            return size
+        return max(int(size * self.draw_scale), 1)
+
+    # Returns the timestamp of sub frame i of the frame number, given the video's frame step in ms
+    def frame_time(self, frame_number, i, step):
+        return self.session_start_time + step * frame_number + (step / self.VID_SCALE) * i
+
+    # Returns a copy of img, a frame prepared by prepare_frame, with the overlay for the timestamp drawn on it.
+    # ranges is the timestamp's entry in a FrameIndex of this renderer, and is looked up when not given
+    def render_frame(self, img, timestamp, ranges=None):
+        use_img = img.copy()
+        overlay = self.overlay
+
+        # Load the next window of a stream, keeping the text boxes found so far
+        if self.stream is not None and timestamp >= self.window_end:
+            prev_img, boxes, box_index = self.prev_img, self.boxes, self.box_index
+            self.seek(timestamp)
+            self.prev_img, self.boxes, self.box_index = prev_img, boxes, box_index
+            ranges = None
+        if ranges is None:
+            ranges = FrameIndex(self, [timestamp]).frame(0)
+        gaze_begin, gaze_end, fixation_begin, fixation_end, saccade = ranges
+
+        # Update text boxes if highlighting
+        if self.highlight:
+            boxes = get_text_boxes(img, self.prev_img, self.boxes, self.change_detector, self.layout_cache, self.draw_text_region)
+            if boxes is not self.boxes:
+                self.box_index = BoxIndex(boxes)
+            self.boxes = boxes
+        overlay.clear()
+        # Draw Saccades
+        if saccade != -1:
+            self.draw_saccade(overlay, use_img.shape, timestamp, saccade)
+        # Draw Gazes
+        if gaze_end > gaze_begin:
+            self.draw_gaze(overlay, gaze_begin, gaze_end)
+        # Draw Fixations
+        if fixation_end != -1:
+            self.draw_fixation(overlay, use_img.shape, timestamp, fixation_begin, fixation_end)
+        overlay.composite(use_img)
+        # Highlight the text box under the current fixation
+        if fixation_end != -1 and self.highlight:
+            fixation = self.fixations[fixation_end]
+            highlight_point(use_img, self.box_index, fixation.x * self.draw_scale, fixation.y * self.draw_scale, self.highlightColor)
+
+        self.prev_img = img
+        return use_img
+
+    # Renders frames [start_frame, end_frame) of the video to output_file_name, encoded with the
+    # EncoderSettings encoder (by default OpenCV, with the fourcc chosen by the file extension).
+    # With a frame_step above 1 only every frame_step-th frame is drawn, at a frame rate lowered to match;
+    # the frames between are skipped with grab(), which does not decode them into images.
+    # Decoding, drawing and encoding overlap through a FramePipeline, whose throughput report is
+    # printed when verbose. progress(frames_written, total_frames) is called after every drawn frame
+    def render(self, video_path, output_file_name, start_frame=0, end_frame=None, progress=None, queue_size=DEFAULT_QUEUE_SIZE, verbose=True, encoder=None, frame_step=1):
+        video = cv2.VideoCapture(video_path)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        width, height = self.frame_size(int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if end_frame is None:
+            end_frame = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        SeekVideo(video, start_frame)
+
+        video_out = (encoder or EncoderSettings()).open(output_file_name, int(fps) / frame_step, (width, height))
+
+        step = (1 / fps) * 1000
+        frame_numbers = np.arange(start_frame, end_frame, frame_step)
+        total = len(frame_numbers) * self.VID_SCALE
+        timestamps = self.frame_time(frame_numbers.repeat(self.VID_SCALE), np.tile(np.arange(self.VID_SCALE), len(frame_numbers)), step)
+        self.seek(self.frame_time(start_frame, 0, step))
+        # A stream's data changes as it is drawn, so its ranges are looked up frame by frame
+        frame_index = FrameIndex(self, timestamps) if self.stream is None else None
+
+        # Runs on the decoding thread, so resizing draft frames overlaps with drawing
+        def read():
+            ret, img = video.read()
+            for _ in range(frame_step - 1):
+                video.grab()
+            return ret, (self.prepare_frame(img) if ret else img)
+
+        def draw(index, img):
+            outputs = []
+            for i in range(index * self.VID_SCALE, (index + 1) * self.VID_SCALE):
+                outputs.append(self.render_frame(img, timestamps[i], frame_index.frame(i) if frame_index is not None else None))
+            if progress is not None:
+                progress((index + 1) * self.VID_SCALE, total)
+            return outputs
+
+        pipeline = FramePipeline(queue_size)
+        try:
+            count = pipeline.run(read, draw, video_out.write, len(frame_numbers))
+        finally:
+            video.release()
+            video_out.release()
+        if verbose:
+            print(pipeline.summary())
+            if self.highlight:
+                if self.text_region is not None:
+                    print("Text region:", self.text_region)
+                print(self.change_detector.summary())
+                print(self.layout_cache.summary())
+        return count
+
+    # Draws the fixations [begin, current) fading out over the rolling window, and the current fixation growing
+    def draw_fixation(self, overlay, shape, timestamp, begin, current):
+        end_times = self.fixation_end_times
+
+        # Draw fixations in the rolling window
+        window = slice(begin, current)
+        points = self.fixation_points[window]
+        keep = self.fixation_valid[window] & (points[:, 0] < shape[0]) & (points[:, 1] < shape[1]) & (points[:, 0] > 0) & (points[:, 1] > 0)
+        radii = ((self.FIXATION_RADIUS + self.fixations.duration[window] // 50) * self.draw_scale).astype(np.int64)
+        transparencies = ((self.ROLLING_WIN_SIZE - (timestamp - end_times[window])) / self.ROLLING_WIN_SIZE) * 100
+        overlay.add_circles(points[keep], radii[keep], self.fixationColor, transparencies[keep])
+
+        if self.fixation_valid[current]:
+            point = self.fixation_points[current]
+            overlay.add_circle(int(point[0]), int(point[1]), self.draw_size(self.FIXATION_RADIUS + int(timestamp - self.fixation_start_times[current]) // 50), self.fixationColor, 100)
+        # move the fixation_gazes into the draw gazes. check if the gazes are part of a fixation_gazes and then change color
+
+    # Draws the gazes [begin, end), each more opaque than the one before
+    def draw_gaze(self, overlay, begin, end):
+        window = slice(begin, end)
+        points = self.gaze_points[window][self.gaze_valid[window]]
+        transparency_increment = 100 / (end - begin) # Amount to increment
+        transparency = int(transparency_increment) # Percentage value
+        # Transparency increases with each drawn gaze until it would reach 100%
+        steps = max(int(np.ceil((100 - transparency) / transparency_increment)) - 1, 0)
+        transparencies = transparency + np.minimum(np.arange(len(points)), steps) * transparency_increment
+        overlay.add_circles(points, self.draw_size(self.GAZE_RADIUS), self.gazeColor, transparencies)
+
+    # Draws the saccade as a line through its gazes once it has started
+    def draw_saccade(self, overlay, shape, timestamp, saccade):
+        if self.saccade_start_times[saccade] > timestamp:
+            return
+        if saccade == len(self.saccades):
+            line = self.get_open_saccade_line(shape)
+            if line is not None:
+                overlay.add_mask(*line, self.saccadeColor)
+            return
+        start, end = self.saccades[saccade]
+        overlay.add_polyline(self.gaze_points[start:end][self.gaze_valid[start:end]], self.saccadeColor, self.draw_size(2))
+
+    # Returns the (x0, y0, mask) of the open saccade's line in frames of the shape, or None if it draws nothing.
+    # The line is drawn once, a chunk of gazes at a time into a mask the size of the frame. Each chunk's line
+    # starts at the last point of the one before, and cv2 draws a polyline segment by segment, so the pixels
+    # are the same as drawing the line through all of its gazes at once
+    def get_open_saccade_line(self, shape):
+        if self.open_saccade_line is None or self.open_saccade_line[0] != shape[:2]:
+            height, width = shape[:2]
+            mask = np.zeros((height, width), dtype=bool)
+            points = np.empty((0, 2), dtype=np.int32)
+            for chunk in self.open_saccade.chunks():
+                points = np.concatenate((points[-1:], GetDrawPoints(chunk, self.draw_scale)[0].astype(np.int32)))
+                if len(points) < 2:
+                    continue
+                line = polyline_mask(points, self.draw_size(2), height, width)
+                if line is not None:
+                    x0, y0, line = line
+                    mask[y0:y0 + line.shape[0], x0:x0 + line.shape[1]] |= line
+            line = None
+            ys, xs = np.nonzero(mask)
+            if len(ys) != 0:
+                y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+                line = (int(x0), int(y0), mask[y0:y1, x0:x1])
+            self.open_saccade_line = (shape[:2], line)
+        return self.open_saccade_line[1]
+
+
+# Moves the capture so the next frame read is frame_number. Setting the position makes the backend seek to
+# the keyframe before it and decode forward; when a backend lands elsewhere, the remaining frames are skipped
+# with grab(), which does not convert them
+def SeekVideo(video, frame_number):
+    if frame_number == 0 and video.get(cv2.CAP_PROP_POS_FRAMES) == 0:
+        return
+    video.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+    position = int(video.get(cv2.CAP_PROP_POS_FRAMES))
+    if position > frame_number:
+        video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        position = int(video.get(cv2.CAP_PROP_POS_FRAMES))
+    while position < frame_number and video.grab():
+        position += 1
+
+# Returns the [start_frame, end_frame) range of a clip of a video with fps and frame_count frames.
+# The clip is given by start and end times in seconds from the start of the video, or by frame numbers,
+# which take precedence. Missing bounds default to the start and end of the video
+def ClipFrameRange(fps, frame_count, start=None, end=None, start_frame=None, end_frame=None):
+    if start_frame is None:
+        start_frame = int(np.floor(start * fps)) if start is not None else 0
+    if end_frame is None:
+        end_frame = int(np.ceil(end * fps)) if end is not None else frame_count
+    start_frame, end_frame = max(start_frame, 0), min(end_frame, frame_count)
+    if start_frame >= end_frame:
+        raise ValueError(f"The clip from frame {start_frame} to {end_frame} is empty")
+    return start_frame, end_frame
+
+# Random access to the frames of a video with a renderer's overlay drawn on them, for previewing.
+# The overlay ranges of every frame come from one FrameIndex, so any frame is drawn without stepping
+# through the ones before it. Frames read in order are decoded one after another; any other jump seeks
+# the capture. The last buffer_size drawn frames are kept in a ring buffer, slot frame_number % buffer_size,
+# so stepping back and forth around the current frame does not decode or draw again.
+# The renderer must hold its data in memory. frame() may be called from any one thread at a time
+class PreviewFrames:
+    def __init__(self, renderer, video_path, buffer_size=DEFAULT_PREVIEW_BUFFER):
+        if renderer.stream is not None:
+            raise ValueError("A streaming renderer cannot be previewed")
+        self.renderer = renderer
+        self.video = cv2.VideoCapture(video_path)
+        if not self.video.isOpened():
+            raise IOError(f"Error loading video file {video_path}")
+        self.fps = self.video.get(cv2.CAP_PROP_FPS)
+        self.frame_count = self.readable_frames(int(self.video.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.width = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        self.timestamps = renderer.frame_time(np.arange(self.frame_count), 0, (1 / self.fps) * 1000)
+        self.index = FrameIndex(renderer, self.timestamps)
+
+        # Allocated on first use, pages are only committed as slots fill
+        self.buffer = None
+        self.buffer_frames = np.full(buffer_size, -1, dtype=np.int64)
+        self.position = -1 # Frame the capture reads next, -1 when unknown
+        self.drawn = -1 # Last frame drawn, whose text boxes carry over to the frame after it
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.frame_count
+
+    # Returns how many of the frame_count frames the video reports can be read. The count in the header is often
+    # a few frames over near the end of a file, so the last frame is tried, and on failure the last readable
+    # frame is found by binary search
+    def readable_frames(self, frame_count):
+        def readable(frame_number):
+            SeekVideo(self.video, frame_number)
+            return self.video.grab()
+        if frame_count <= 0 or readable(frame_count - 1):
+            return max(frame_count, 0)
+        low, high = 0, frame_count - 1 # Frames before low read, frame high does not
+        while low < high:
+            middle = (low + high) // 2
+            if readable(middle):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Returns the frame number shown at seconds from the start of the video
+    def frame_at(self, seconds):
+        return int(min(max(seconds * self.fps, 0), self.frame_count - 1))
+
+    # Returns the seconds from the start of the video of the frame number
+    def time_of(self, frame_number):
+        return frame_number / self.fps
+
+    # Returns True when the frame number is in the ring buffer
+    def buffered(self, frame_number):
+        return self.buffer_frames[frame_number % len(self.buffer_frames)] == frame_number
+
+    # Returns the frame number with the overlay drawn on it, or None when it cannot be decoded.
+    # The returned image belongs to the ring buffer and is overwritten buffer_size frames later
+    def frame(self, frame_number):
+        with self.lock:
+            slot = frame_number % len(self.buffer_frames)
+            if self.buffer_frames[slot] == frame_number:
+                return self.buffer[slot]
+
+            if frame_number != self.position:
+                SeekVideo(self.video, frame_number)
+            ret, img = self.video.read()
+            if not ret:
+                self.position = -1
+                return None
+            self.position = frame_number + 1
+
+            renderer = self.renderer
+            timestamp = self.timestamps[frame_number]
+            if frame_number != self.drawn + 1:
+                renderer.seek(timestamp)
+            drawn = renderer.render_frame(renderer.prepare_frame(img), timestamp, self.index.frame(frame_number))
+            self.drawn = frame_number
+
+            if self.buffer is None:
+                self.buffer = np.empty((len(self.buffer_frames),) + drawn.shape, dtype=drawn.dtype)
+            self.buffer[slot] = drawn
+            self.buffer_frames[slot] = frame_number
+            return self.buffer[slot]
+
+    def close(self):
+        with self.lock:
+            self.video.release()
+            self.buffer = None
+            self.buffer_frames[:] = -1
+
+
+# Renders one segment in a worker process. Returns the segment path and number of frames written
+def _RenderSegment(job):
+    renderer, video_path, segment_path, start_frame, end_frame, encoder, frame_step = job
+    return segment_path, renderer.render(video_path, segment_path, start_frame, end_frame, verbose=False, encoder=encoder, frame_step=frame_step)
+
+# Splits [0, frames) into count contiguous ranges of near equal length
+def SplitFrameRanges(frames, count):
+    count = max(1, min(count, frames))
+    bounds = [frames * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i+1]) for i in range(count)]
+
+# Joins the segment videos, in order, into output_file_name.
+# Segments already encoded for the output are copied without re-encoding when copy is set and ffmpeg is on
+# the PATH; otherwise their frames are decoded and encoded again with the EncoderSettings encoder
+def JoinSegments(segment_paths, output_file_name, fps, size, encoder=None, copy=True):
+    if copy and shutil.which("ffmpeg"):
+        list_path = os.path.join(os.path.dirname(segment_paths[0]), "segments.txt")
+        with open(list_path, "w") as list_file:
+            for path in segment_paths:
+                list_file.write("file '" + os.path.abspath(path).replace("'", "'\\''") + "'\n")
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_file_name], check=True)
+        return
+
+    if copy:
+        print("ffmpeg not found, re-encoding segments")
+    video_out = (encoder or EncoderSettings()).open(output_file_name, fps, size)
+    for path in segment_paths:
+        segment = cv2.VideoCapture(path)
+        while True:
+            ret, img = segment.read()
+            if not ret:
+                break
+            video_out.write(img)
+        segment.release()
+    video_out.release()
+
+# Renders frames [start_frame, end_frame) of the video, by default all of it, with the renderer across worker processes.
+# The frames are split into ranges, each worker seeks its own capture to its range and renders
+# it with only the slice of data it needs, and the resulting segments are joined in order.
+# The output is encoded with the EncoderSettings encoder. With lossless_segments the segments are written
+# losslessly and encoded once when joined, instead of being encoded for the output and copied together;
+# by default they are when there is no ffmpeg to copy them with, so frames are never encoded lossily twice.
+# frame_step draws every frame_step-th frame, as GazeVideoRenderer.render.
+# progress(frames_written, total_frames) is called as segments finish
+def RenderVideoParallel(renderer, video_path, output_file_name, processes=None, segments=None, progress=None, start_frame=0, end_frame=None,
+                        encoder=None, lossless_segments=None, frame_step=1):
+    processes = processes or os.cpu_count() or 1
+    encoder = encoder or EncoderSettings()
+    if lossless_segments is None:
+        lossless_segments = shutil.which("ffmpeg") is None and not encoder.is_lossless()
+    segment_encoder = EncoderSettings.lossless() if lossless_segments else encoder
+    segment_extension = LOSSLESS_EXTENSION if lossless_segments else os.path.splitext(output_file_name)[1] or ".avi"
+    video = cv2.VideoCapture(video_path)
+    fps = video.get(cv2.CAP_PROP_FPS)
+    if end_frame is None:
+        end_frame = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    size = renderer.frame_size(int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    video.release()
+
+    step = (1 / fps) * 1000
+    # Split the frames drawn, so every segment starts on one of them
+    frames = len(range(start_frame, end_frame, frame_step))
+    ranges = [(start_frame + begin * frame_step, min(start_frame + end * frame_step, end_frame))
+              for begin, end in SplitFrameRanges(frames, segments or processes * DEFAULT_SEGMENTS_PER_PROCESS)]
+    total = frames * renderer.VID_SCALE
+
+    temp_dir = tempfile.mkdtemp(prefix="itrace-segments-", dir=os.path.dirname(os.path.abspath(output_file_name)))
+    try:
+        jobs = []
+        for i, (segment_start, segment_end) in enumerate(ranges):
+            segment_path = os.path.join(temp_dir, f"segment{i:05d}{segment_extension}")
+            segment_renderer = renderer.slice(renderer.frame_time(segment_start, 0, step), renderer.frame_time(segment_end, 0, step))
+            jobs.append((segment_renderer, video_path, segment_path, segment_start, segment_end, segment_encoder, frame_step))
+
+        count = 0
+        with multiprocessing.Pool(min(processes, len(jobs))) as pool:
+            for _, written in pool.imap_unordered(_RenderSegment, jobs):
+                count += written
+                if progress is not None:
+                    progress(count, total)
+
+        JoinSegments([job[2] for job in jobs], output_file_name, int(fps) / frame_step, size, encoder, copy=not lossless_segments)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return count
+
+
+# Renders the gaze cloud video of one session without any GUI. renderer_options are passed on to GazeVideoRenderer.
+# A clip of the video is rendered when given start/end times in seconds or start/end frame numbers (see ClipFrameRange):
+# the video is seeked to it and only the data it draws is read. encoder is the EncoderSettings to write with,
+# and lossless_segments is passed on to RenderVideoParallel. frame_step draws every frame_step-th frame only.
+# A draft render, for checking the data lines up with the recording, draws at DRAFT_SCALE of the video's size
+# (unless a draw_scale is given) and at most DRAFT_FPS (unless a frame_step is given). Returns the number of frames written
+def RenderSession(db_path, session_id, video_path, output_file_name, fixation_run_id=None, saccades=True, processes=1, create_indexes=False,
+                  start=None, end=None, start_frame=None, end_frame=None, encoder=None, lossless_segments=None,
+                  draft=False, frame_step=None, **renderer_options):
+    started = time.time()
+    idb = iTraceDB(db_path, create_indexes)
+
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        raise IOError(f"Error loading video file {video_path}")
+    fps = video.get(cv2.CAP_PROP_FPS)
+    frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video_time = frame_count / fps
+    video.release()
+    session_time = idb.GetSessionTimeLength(session_id)
+    if abs(session_time - video_time) >= 1:
+        print(f"Warning: the session length ({session_time:.1f}s) does not match the video length ({video_time:.1f}s)")
+    start_frame, end_frame = ClipFrameRange(fps, frame_count, start, end, start_frame, end_frame)
+    if (start_frame, end_frame) != (0, frame_count):
+        print(f"Rendering frames {start_frame} to {end_frame} of {frame_count}")
+    if draft:
+        renderer_options.setdefault("draw_scale", DRAFT_SCALE)
+        if frame_step is None:
+            frame_step = DraftFrameStep(fps)
+        print(f"Draft render at {renderer_options['draw_scale']:g}x size, every {frame_step} frames")
+    frame_step = frame_step or 1
+
+    # A single process streams the data as it draws, workers each need their slice of it loaded up front
+    session_start_time = idb.GetSessionStartTime(session_id)
+    if processes > 1:
+        gazes, fixations, saccades = LoadSessionData(idb, session_id, fixation_run_id, saccades)
+        renderer = GazeVideoRenderer(gazes, fixations, saccades, session_start_time, **renderer_options)
+    else:
+        clip_start_time = session_start_time + start_frame * (1 / fps) * 1000 if start_frame != 0 else None
+        stream = LoadSessionStream(idb, session_id, fixation_run_id, saccades, start_time=clip_start_time,
+                                   rolling_win_size=renderer_options.get("rolling_win_size", DEFAULT_ROLLING_WIN_SIZE))
+        renderer = GazeVideoRenderer.from_stream(stream, session_start_time, **renderer_options)
+
+    last_report = [time.time()]
+    def progress(count, total):
+        if time.time() - last_report[0] >= 15:
+            print(f"{count / total * 100:.1f}%")
+            last_report[0] = time.time()
+
+    print("Writing Video")
+    if processes > 1:
+        count = RenderVideoParallel(renderer, video_path, output_file_name, processes=processes, progress=progress, start_frame=start_frame, end_frame=end_frame,
+                                    encoder=encoder, lossless_segments=lossless_segments, frame_step=frame_step)
+    else:
+        count = renderer.render(video_path, output_file_name, start_frame, end_frame, progress=progress, encoder=encoder, frame_step=frame_step)
+    print("Wrote", count, "frames to", output_file_name, "Elapsed:", time.time() - started)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render an iTrace gaze cloud video without the GUI")
+    parser.add_argument("database", help="iTrace-Toolkit SQLite database")
+    parser.add_argument("session_id", type=int)
+    parser.add_argument("video", help="Screen recording of the session")
+    parser.add_argument("output", help="Output video file")
+    parser.add_argument("--fixation-run", type=int, default=None, help="Fixation run to draw fixations and saccades from")
+    parser.add_argument("--fade-delay", type=int, default=DEFAULT_ROLLING_WIN_SIZE // 1000, help="Fade delay in seconds")
+    parser.add_argument("--stretch", type=int, default=DEFAULT_VID_SCALE, help="Video stretch factor")
+    parser.add_argument("--gaze-radius", type=int, default=DEFAULT_GAZE_RADIUS, help="Gaze radius in pixels")
+    parser.add_argument("--fixation-radius", type=int, default=DEFAULT_FIXATION_RADIUS, help="Base fixation radius in pixels")
+    parser.add_argument("--no-highlight", action="store_true", help="Do not highlight the line under the current fixation")
+    parser.add_argument("--text-region", type=ParseTextRegion, default=None, help="Part of the screen to search for text: auto (inferred from the fixations) or x0,y0,x1,y1")
+    parser.add_argument("--change-threshold", type=float, default=DEFAULT_CHANGE_THRESHOLD, help="Percent of the frame that must change before text is detected again")
+    parser.add_argument("--layout-cache", type=int, default=DEFAULT_LAYOUT_CACHE_BYTES // (1024 * 1024), help="Memory in MB for caching the text boxes of screens seen before")
+    parser.add_argument("--no-saccades", action="store_true", help="Do not mark saccades")
+    parser.add_argument("--gaze-color", default="#00ffff", help="Gaze color as #RRGGBB")
+    parser.add_argument("--saccade-color", default="#ffffff", help="Saccade color as #RRGGBB")
+    parser.add_argument("--fixation-color", default="#ff0000", help="Fixation color as #RRGGBB")
+    parser.add_argument("--highlight-color", default="#0000ff", help="Highlight color as #RRGGBB")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes to render with")
+    parser.add_argument("--start", type=float, default=None, help="Start of the clip to render, in seconds from the start of the video")
+    parser.add_argument("--end", type=float, default=None, help="End of the clip to render, in seconds from the start of the video")
+    parser.add_argument("--start-frame", type=int, default=None, help="First frame of the clip to render (overrides --start)")
+    parser.add_argument("--end-frame", type=int, default=None, help="Frame the clip to render ends before (overrides --end)")
+    parser.add_argument("--draft", action="store_true", help=f"Quick draft render at {DRAFT_SCALE:g}x size and at most {DRAFT_FPS} frames per second")
+    parser.add_argument("--scale", type=float, default=None, help="Size to render at relative to the video, such as 0.5")
+    parser.add_argument("--frame-step", type=int, default=None, help="Only render every N-th frame of the video")
+    parser.add_argument("--encoder", choices=ENCODER_BACKENDS, default="opencv", help="Encode with OpenCV, or by piping frames to ffmpeg")
+    parser.add_argument("--fourcc", default=None, help="OpenCV codec fourcc (default chosen by the output extension: mp4v for .mp4, XVID otherwise)")
+    parser.add_argument("--codec", default=DEFAULT_FFMPEG_CODEC, help="ffmpeg video codec")
+    parser.add_argument("--preset", default=DEFAULT_PRESET, help="ffmpeg encoder preset")
+    parser.add_argument("--crf", type=int, default=DEFAULT_CRF, help="ffmpeg constant rate factor, lower is higher quality")
+    parser.add_argument("--encode-threads", type=int, default=DEFAULT_ENCODE_THREADS, help="ffmpeg encoder threads (0 lets ffmpeg choose)")
+    parser.add_argument("--lossless-segments", action="store_true", default=None, help="Write parallel segments losslessly and encode them once when joining")
+    parser.add_argument("--create-indexes", action="store_true", help="Add any missing indexes to the database (writes to the database file)")
+    args = parser.parse_args(argv)
+
+    # Left out unless given, so a draft's own scale applies
+    scale_option = {"draw_scale": args.scale} if args.scale is not None else {}
+    RenderSession(args.database, args.session_id, args.video, args.output,
+                  fixation_run_id=args.fixation_run, saccades=not args.no_saccades, processes=args.processes,
+                  create_indexes=args.create_indexes,
+                  start=args.start, end=args.end, start_frame=args.start_frame, end_frame=args.end_frame,
+                  encoder=EncoderSettings(args.encoder, args.fourcc, args.codec, args.preset, args.crf, args.encode_threads),
+                  lossless_segments=args.lossless_segments, draft=args.draft, frame_step=args.frame_step,
+                  rolling_win_size=args.fade_delay * 1000, gaze_radius=args.gaze_radius,
+                  fixation_radius=args.fixation_radius, vid_scale=args.stretch, highlight=not args.no_highlight,
+                  change_threshold=args.change_threshold, text_region=args.text_region, layout_cache_bytes=args.layout_cache * 1024 * 1024,
+                  gaze_color=ConvertColorStringToTuple(args.gaze_color), saccade_color=ConvertColorStringToTuple(args.saccade_color),
+                  fixation_color=ConvertColorStringToTuple(args.fixation_color), highlight_color=ConvertColorStringToTuple(args.highlight_color),
+                  **scale_option)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,78 +1,37 @@
 # This Python file uses the following encoding: utf-8
+import os
 import sys
 import cv2
 import time
 import numpy as np
-import math
-import re
 import random
 import colorsys
+import shutil
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 from PIL import Image, ImageFont, ImageDraw
 
-from lxml import etree as ET
 from iTraceDB import iTraceDB
-from EyeDataTypes import Gaze, Fixation
-from TextDetector import get_text_boxes, highlight_frame
+from SrcmlArchive import UnitText, TokenIndex, ElementText, CountTokens, CountCategories, PositionSpan
+from SrcmlCache import CachedSrcmlArchive
+from EyeDataTypes import Fixation, ConvertWindowsTime
+from VideoRenderer import GazeVideoRenderer, RenderVideoParallel, LoadSessionData, LoadSessionStream, ClipFrameRange, PreviewFrames
+from VideoRenderer import ConvertColorStringToTuple, ConvertColorTupleToString
+from VideoRenderer import DEFAULT_ROLLING_WIN_SIZE, DEFAULT_GAZE_RADIUS, DEFAULT_FIXATION_RADIUS, DEFAULT_VID_SCALE, DRAFT_SCALE, DraftFrameStep
 
 from PySide6 import QtCore, QtWidgets, QtGui
-
-import ctypes
-myappid = 'mycompany.myproduct.subproduct.version' # arbitrary string
-ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+from PreviewPlayer import PreviewPlayer
+from VideoEncoder import EncoderSettings
 
 WIN_WIDTH, WIN_HEIGHT = 950, 465
-DEFAULT_ROLLING_WIN_SIZE = 1000 # Size of rolling window in miliseconds
-DEFAULT_GAZE_RADIUS = 5
-DEFAULT_FIXATION_RADIUS = 5
-DEFAULT_VID_SCALE = 1 # INCREASING THIS CAUSES THE VIDEO TO BECOME MUCH LONGER, AND HAVE MUCH MORE DETAIL
 DEFAULT_NUM_OF_COLORS = 5
+DEFAULT_RENDER_PROCESSES = os.cpu_count() or 1
 
 fontTitle = {'family':'serif','color':'black','size':20}
 fontTitle2 = {'family':'serif','color':'black','size':15}
 fontLabelX = {'family':'serif','color':'black','size':15}
 fontLabelY = {'family':'serif','color':'black','size':15}
 
-# Converts color string (rgb) to color tuple (bgr)
-def ConvertColorStringToTuple(color: "#XXXXXX") -> tuple[int]:
-    color = color[1:]
-    b = int(color[4:6],base=16)
-    g = int(color[2:4],base=16)
-    r = int(color[0:2],base=16)
-    return (b,g,r)
-
-# converts color tuple (bgr) to color string (rgb)
-def ConvertColorTupleToString(color: tuple[int]) -> "#XXXXXX":
-    return "#"+str(hex(color[2]))[2:].zfill(2)+str(hex(color[1]))[2:].zfill(2)+str(hex(color[0]))[2:].zfill(2)
-
-# Converts windows time to Unix time
-def ConvertWindowsTime(t) -> int:
-    return ((t / 10000000) - 11644473600) * 1000
-
-# Takes the list of Fixations and Gazes and figures out the saccades
-# Saccades are defined as the group of gazes between two consecutive fixations
-def GetSaccadesOfGazesAndFixationGazes(idb,gazes,fixation_gazes) -> list[list[Gaze]]:
-    fix_gaze_times = []
-    for fix_id in fixation_gazes:
-        for fixation_gaze in fixation_gazes[fix_id]:
-            fix_gaze_times.append(Gaze(idb.GetGazeFromEventTime(fixation_gaze[1])).system_time)
-    saccades = []
-    add = []
-
-    for gaze in gazes:
-        if gaze.system_time in fix_gaze_times and len(add) == 0: #Do nothing, looking for next saccade
-            pass
-        elif gaze.system_time in fix_gaze_times and len(add) != 0: #End current saccade, start new one
-            saccades.append(add)
-            add = []
-        elif gaze.system_time not in fix_gaze_times and not gaze.isNaN():
-            add.append(gaze)
-    if len(add) != 0:
-        saccades.append(add)
-
-    return saccades
-
 def FindMatchingPath(all_files,target_file):
     target_file.replace("\\","/")
     target_file = target_file.lower()
@@ -112,26 +71,22 @@ def FindMatchingPath(all_files,target_file):
         return None;
     return "/".join(possible[0])
 
-def GetLineAndCol(element):
-    try:
-        return (int(element.attrib["{http://www.srcML.org/srcML/position}start"].split(":")[0]),
-                int(element.attrib["{http://www.srcML.org/srcML/position}start"].split(":")[1]),
-                int(element.attrib["{http://www.srcML.org/srcML/position}end"].split(":")[0]),
-                int(element.attrib["{http://www.srcML.org/srcML/position}end"].split(":")[1]))
-    except:
-        xml_remover = re.compile("<.*?>")
-        text = xml_remover.sub('',ET.tostring(element).decode()).replace("&gt;",">").replace("&lt;","<").replace("&amp;","&")
-        return (1,1,len(text.split("\n")),max([len(x.rstrip()) for x in text.split("\n")]))
-
-def GetTokenStartPoint(line_start,col_start,elements):
-    xml_remover = re.compile("<.*?>")
+# Returns the decoded text of an element, from the archive's cache when given one
+def GetElementText(element, archive=None):
+    return archive.text(element) if archive is not None else UnitText(ElementText(element))
+
+def GetLineAndCol(element, archive=None):
+    span = PositionSpan(element)
+    if span is None:
+        return (1,1) + GetElementText(element, archive).extent()
+    return span
+
+def GetTokenStartPoint(line_start,col_start,elements,archive=None):
     for element in elements:
         if type(element) == str:
-            s = element
+            lines = element.replace("&gt;",">").replace("&lt;","<").replace("&amp;","&").split('\n')
         else:
-            s = xml_remover.sub('',ET.tostring(element).decode())
-        s = s.replace("&gt;",">").replace("&lt;","<").replace("&amp;","&")
-        lines = s.split('\n')
+            lines = GetElementText(element, archive).lines
         if len(lines) > 1:
             line_start += len(lines) - 1
             col_start = 0
@@ -139,43 +94,10 @@ def GetTokenStartPoint(line_start,col_start,elements):
     return line_start, col_start
 
 
-SINGLE_CHAR_TOKENS = ["{","}","[","]","(",")","'",'"',".",",",";"]
-def FindTokenInElement(line,col,element):
-    xml_remover = re.compile("<.*?>")
-    text = xml_remover.sub('',ET.tostring(element).decode()).replace("&gt;",">").replace("&lt;","<").replace("&amp;","&")
-    lines = text.split("\n")
-    token_line = lines[line - 1]
-
-    if col > len(token_line):
-        #return ((line,col),(line,col))
-        return
-
-    char = token_line[col - 1]
-    if char.isspace():
-        return
-    elif char in SINGLE_CHAR_TOKENS:
-        return ((line,col),(line,col))
-    elif char.isalnum():
-        mode = "word"
-    else:
-        mode = "op"
-
-    start = col - 1
-    end = col - 1
-
-    while token_line[start].isalnum() if mode == "word" else ((not token_line[start].isalnum()) and (not token_line[start].isspace()) and (token_line[start] not in SINGLE_CHAR_TOKENS)):
-        start -= 1
-        if start < 0:
-            start = -1
-            break
-
-    while token_line[end].isalnum() if mode == "word" else ((not token_line[end].isalnum()) and (not token_line[end].isspace()) and (token_line[end] not in SINGLE_CHAR_TOKENS)):
-        end += 1
-        if end > len(token_line) - 1:
-            end = len(token_line)
-            break
-
-    return ((line,start+2),(line,end))
+# Returns the span of the token at line and col of the element as ((line, start col), (line, end col)), or None
+def FindTokenInElement(line,col,element,archive=None):
+    tokens = archive.tokens(element) if archive is not None else TokenIndex(GetElementText(element))
+    return tokens.find(line, col)
 
 
 
@@ -407,11 +329,51 @@ class MyWidget(QtWidgets.QWidget):
         self.base_fixation_radius_text = QtWidgets.QLabel("Base Fixation Radius (pixels)",self)
         self.video_layout.addWidget(self.base_fixation_radius_text,17,22)
 
+        ## Render Processes
+        self.render_processes_box = QtWidgets.QLineEdit(self)
+        self.render_processes_box.setGeometry(620,450,25,20)
+        self.render_processes_box.setValidator(QtGui.QIntValidator(1, DEFAULT_RENDER_PROCESSES))
+        self.render_processes_box.setText(str(DEFAULT_RENDER_PROCESSES))
+        self.video_layout.addWidget(self.render_processes_box,18,21)
+        self.render_processes_text = QtWidgets.QLabel("Render Processes",self)
+        self.video_layout.addWidget(self.render_processes_text,18,22)
+
+        ## Clip Start and End, empty for the whole video
+        self.clip_start_box = QtWidgets.QLineEdit(self)
+        self.clip_start_box.setGeometry(620,475,25,20)
+        self.clip_start_box.setValidator(QtGui.QDoubleValidator(0, 1e9, 3))
+        self.video_layout.addWidget(self.clip_start_box,19,21)
+        self.clip_start_text = QtWidgets.QLabel("Clip Start (seconds)",self)
+        self.video_layout.addWidget(self.clip_start_text,19,22)
+        self.clip_end_box = QtWidgets.QLineEdit(self)
+        self.clip_end_box.setGeometry(620,500,25,20)
+        self.clip_end_box.setValidator(QtGui.QDoubleValidator(0, 1e9, 3))
+        self.video_layout.addWidget(self.clip_end_box,20,21)
+        self.clip_end_text = QtWidgets.QLabel("Clip End (seconds)",self)
+        self.video_layout.addWidget(self.clip_end_text,20,22)
+
+        ## ffmpeg Encoding Checkbox, H.264 files are much smaller than OpenCV's MPEG-4
+        self.ffmpeg_encode_box = QtWidgets.QCheckBox("Encode with ffmpeg",self)
+        self.ffmpeg_encode_box.setEnabled(shutil.which("ffmpeg") is not None)
+        self.ffmpeg_encode_box.setChecked(self.ffmpeg_encode_box.isEnabled())
+        self.video_layout.addWidget(self.ffmpeg_encode_box,21,22)
+
+        ## Draft Checkbox, a small low frame rate video for checking the data lines up with the recording
+        self.draft_box = QtWidgets.QCheckBox("Draft Quality",self)
+        self.draft_box.setChecked(False)
+        self.video_layout.addWidget(self.draft_box,22,22)
+
         # Start Video Calculation Button
         self.start_video_button = QtWidgets.QPushButton("Start Visualization", self)
         self.start_video_button.clicked.connect(self.startVideoClicked)
         self.video_layout.addWidget(self.start_video_button,16,0)
 
+        # Preview Button
+        self.preview_video_button = QtWidgets.QPushButton("Preview", self)
+        self.preview_video_button.clicked.connect(self.previewVideoClicked)
+        self.video_layout.addWidget(self.preview_video_button,15,0)
+        self.preview_player = None
+
         # Progress Bar
         self.progress_bar = QtWidgets.QProgressBar(self)
         # self.progress_bar.setGeometry(25,450,200,25)
@@ -460,6 +422,11 @@ class MyWidget(QtWidgets.QWidget):
         self.code_layout.addWidget(self.code_srcml_load_button,6,0)
         self.code_layout.addWidget(self.code_srcml_loaded_text,5,0)
 
+        # Syntactic Category Checkbox
+        self.category_process_box = QtWidgets.QCheckBox("Syntax Categories",self)
+        self.category_process_box.setChecked(False)
+        self.code_layout.addWidget(self.category_process_box,7,0)
+
 
         # Number of colors
         self.color_number_box = QtWidgets.QLineEdit(self)
@@ -651,11 +618,12 @@ class MyWidget(QtWidgets.QWidget):
         if(srcml_file_path == ''):
             return
         try:
-            self.code_srcml = ET.parse(srcml_file_path)
+            # Only lists the units, each is parsed when a heatmap needs it, or read from the cache if it was before
+            self.code_srcml = CachedSrcmlArchive.parse(srcml_file_path)
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, "Error", str(e))
             return
-        if("filename" in self.code_srcml.getroot().attrib):
+        if("filename" in self.code_srcml.root.attrib):
             QtWidgets.QMessageBox.critical(self, "srcML Error", "The provided srcML file is not an archive file")
             self.video = None
             return
@@ -1034,51 +1002,83 @@ class MyWidget(QtWidgets.QWidget):
             else:
                 return
 
+        # Frames of the clip to render
+        fps = self.video.get(cv2.CAP_PROP_FPS)
+        clip_start = float(self.clip_start_box.text()) if self.clip_start_box.text() else None
+        clip_end = float(self.clip_end_box.text()) if self.clip_end_box.text() else None
+        try:
+            clip = ClipFrameRange(fps, int(self.video.get(cv2.CAP_PROP_FRAME_COUNT)), clip_start, clip_end)
+        except ValueError as e:
+            QtWidgets.QMessageBox.critical(self, "Error", str(e))
+            return
+        if not self.render_processes_box.hasAcceptableInput():
+            QtWidgets.QMessageBox.critical(self, "Input Error", f"Render processes must be a number from 1 to {DEFAULT_RENDER_PROCESSES}")
+            return
+        processes = int(self.render_processes_box.text())
+
         output_file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self,"Save Video","","MP4(*.mp4)")
         if not output_file_name:
             return
 
-        self.ROLLING_WIN_SIZE = int(self.fade_delay_box.text()) * 1000
-        self.GAZE_RADIUS = int(self.gaze_radius_box.text())
-        self.FIXATION_RADIUS = int(self.base_fixation_radius_box.text())
-        self.VID_SCALE = int(self.video_stretch_box.text())
-
-        t = time.time()
-        print("Gathering Gazes, ",end="")
-        
-        gaze_tups = self.video_idb.GetAllSessionGazes(session_id)
-        gazes = [Gaze(tup) for tup in gaze_tups]
-        print("Len:",len(gazes),"Elapsed:",time.time()-t)
-
-        fixations = None
-        if(len(self.video_fixation_runs_list.selectedItems()) != 0):
-            t = time.time()
-            print("Gathering Fixations, ",end="")
-            fixation_run_id = int(self.video_fixation_runs_list.selectedItems()[0].text().split(" - ")[1])
-            fixation_tups = self.video_idb.GetAllRunFixations(fixation_run_id)
-            fixations = [Fixation(tup) for tup in fixation_tups]
-            print("Len:",len(fixations),"Elapsed:",time.time()-t)
+        self.readVideoOptions()
+        fixation_run_id = self.selectedVideoFixationRun()
 
+        # A single render process streams the data as it draws, workers each need their slice of it loaded up front
+        gazes, fixations, saccades, stream = None, None, None, None
+        if processes > 1:
+            gazes, fixations, saccades = LoadSessionData(self.video_idb, session_id, fixation_run_id, self.draw_saccade_box.isChecked())
+        else:
+            # Only read the data from the start of the clip on
+            clip_start_time = self.session_start_time + clip[0] * (1 / fps) * 1000 if clip[0] != 0 else None
+            stream = LoadSessionStream(self.video_idb, session_id, fixation_run_id, self.draw_saccade_box.isChecked(),
+                                       start_time=clip_start_time, rolling_win_size=self.ROLLING_WIN_SIZE)
         fixation_gazes = None
-        if False: #self.draw_fixation_gazes_box.isChecked():
-            t = time.time()
-            print("Gathering Fixation Gazes, ",end="")
-            fixation_gazes = self.video_idb.GetAllFixationGazes(fixations)
-            print("Len:",len(fixation_gazes),"Elapsed:",time.time()-t)
-
-        saccades = None
-        if self.draw_saccade_box.isChecked():
-            t = time.time()
-            print("Gathering Saccades, ",end="")
-            saccades = GetSaccadesOfGazesAndFixationGazes(self.video_idb, gazes, fixation_gazes if fixation_gazes is not None else self.video_idb.GetAllFixationGazes(fixations))
-            print("Len:",len(saccades),"Elapsed:",time.time()-t)
 
         if self.dejavu:
             print("Gathering Replay Data, Len:",len(self.dejavu))
 
-        self.outputVideo(output_file_name, gazes=gazes, fixations=fixations, fixation_gazes=fixation_gazes, saccades=saccades, replay_data=self.dejavu)
+        self.outputVideo(output_file_name, gazes=gazes, fixations=fixations, fixation_gazes=fixation_gazes, saccades=saccades, replay_data=self.dejavu, stream=stream, clip=clip, processes=processes)
         self.progress_bar.reset()
 
+    def previewVideoClicked(self):
+        if len(self.video_session_list.selectedItems()) == 0 or self.video is None:
+            QtWidgets.QMessageBox.critical(self, "Error", "You are missing a required component")
+            return
+        session_id = int(self.video_session_list.selectedItems()[0].text().split(" - ")[1])
+
+        self.readVideoOptions()
+        fixation_run_id = self.selectedVideoFixationRun()
+        # Frames are drawn in any order while scrubbing, so the data is loaded up front
+        gazes, fixations, saccades = LoadSessionData(self.video_idb, session_id, fixation_run_id, self.draw_saccade_box.isChecked())
+        renderer = GazeVideoRenderer(gazes, fixations, saccades, self.session_start_time, **self.rendererOptions())
+
+        if self.preview_player is not None:
+            self.preview_player.close()
+        self.preview_player = PreviewPlayer(PreviewFrames(renderer, self.video_path), "Preview - Session " + str(session_id))
+        self.preview_player.show()
+
+    # Reads the video options from their boxes
+    def readVideoOptions(self):
+        self.ROLLING_WIN_SIZE = int(self.fade_delay_box.text()) * 1000
+        self.GAZE_RADIUS = int(self.gaze_radius_box.text())
+        self.FIXATION_RADIUS = int(self.base_fixation_radius_box.text())
+        self.VID_SCALE = int(self.video_stretch_box.text())
+
+    # Returns the id of the fixation run selected in the video tab, or None
+    def selectedVideoFixationRun(self):
+        if(len(self.video_fixation_runs_list.selectedItems()) != 0):
+            return int(self.video_fixation_runs_list.selectedItems()[0].text().split(" - ")[1])
+        return None
+
+    # Returns the GazeVideoRenderer options set in the video tab
+    def rendererOptions(self):
+        return dict(rolling_win_size=self.ROLLING_WIN_SIZE, gaze_radius=self.GAZE_RADIUS,
+                    fixation_radius=self.FIXATION_RADIUS, vid_scale=self.VID_SCALE,
+                    highlight=self.highlight_box.isChecked(),
+                    gaze_color=self.gazeColor, saccade_color=self.saccadeColor,
+                    fixation_color=self.fixationColor, highlight_color=self.highlightColor,
+                    draw_scale=DRAFT_SCALE if self.draft_box.isChecked() else 1)
+
     def gazePickerClicked(self): # Show color picker dialog/save color option
         dialog = QtWidgets.QColorDialog(self)
         if self.gazeColor:
@@ -1128,55 +1128,38 @@ class MyWidget(QtWidgets.QWidget):
             self.color_picker_text_highlight.setStyleSheet(f"QLabel {{ background-color : {ConvertColorTupleToString(self.highlightColor)}; }}")
 
 
-    def draw_circle(self, frame, cx, cy, radius, bgr, transparency):
-        for x in range(cx-radius, cx+radius):
-            for y in range(cy-radius, cy+radius):
-                if math.dist([x, y], [cx, cy]) < radius and x >= 0 and y >= 0 and x < frame.shape[1] and y < frame.shape[0]:
-                    b = frame[int(y), int(x), 0] * (100 - transparency) / 100  + bgr[0] * transparency / 100 # get B value
-                    g = frame[int(y), int(x), 1] * (100 - transparency) / 100  + bgr[1] * transparency / 100 # get G value
-                    r = frame[int(y), int(x), 2] * (100 - transparency) / 100  + bgr[2] * transparency / 100 # get R value
-
-                    transparent_bgr = [b,g,r]
-
-                    frame[y, x] = transparent_bgr
-
     # Returns true if the session time and video time are within a second of each other
     def doSessionVideoTimesMatch(self):
         return abs(self.selected_session_time - self.loaded_video_time) < 1
 
     # Creates the output video given the input parameters:
 
-        # gazes - List of Gazes - REQUIRED
+        # gazes - List of Gazes - REQUIRED unless streaming
         # fixations - List of Fixations
-        # fixation_gazes - Dictionary of fixation_ids to fixation_gazes
+        # fixation_gazes - FixationGazeArray of the fixation run
         # saccades - List of list of gazes making up a Saccade
         # replay data - List of mouse and keyboard inputs
         # archive_data - XML data of the srcML Archive File
-    def outputVideo(self, output_file_name, gazes, fixations=None, fixation_gazes = None, saccades=None, replay_data=None, archive_data=None):
+        # stream - SessionStream to read the gazes, fixations and saccades from while drawing, in place of the lists
+        # clip - (start_frame, end_frame) range of the video to render, the whole video when None
+        # processes - Number of processes rendering the video, which are given the loaded lists rather than a stream
+    def outputVideo(self, output_file_name, gazes, fixations=None, fixation_gazes = None, saccades=None, replay_data=None, archive_data=None, stream=None, clip=None, processes=1):
 
         start = time.time()
 
         print("Writing Video")
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        video_out = cv2.VideoWriter(output_file_name, fourcc, self.video_fps, (self.video_width, self.video_height))
-
-        video_len = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT)) * self.VID_SCALE
-
-        stamp = self.session_start_time
-        step = (1 / self.video.get(cv2.CAP_PROP_FPS)) * 1000
+        options = self.rendererOptions()
+        if stream is not None:
+            renderer = GazeVideoRenderer.from_stream(stream, self.session_start_time, **options)
+        else:
+            renderer = GazeVideoRenderer(gazes, fixations, saccades, self.session_start_time, **options)
 
-        current_gaze = 0
-        begin_gaze_window = 0
-        current_fixation = 0 if len(fixations) != 0 else -1
-        begin_fixation_window = current_fixation
-        current_saccade = 0 if saccades != None and len(saccades) != 0 else -1
-        current_replay = 1 if replay_data != None and len(replay_data) != 0 else -1
-
-        count = 0
-        write_loop_time = time.time()
-        prev_img = None
-        boxes = None
-        while True:
+        last_update = [0]
+        def progress(count, video_len):
+            # Repainting the window is far slower than drawing a frame, so only update a few times a second
+            if time.time() - last_update[0] < 0.1 and count != video_len:
+                return
+            last_update[0] = time.time()
             self.progress_bar.setValue(int(count/video_len*100))
             dt = int(time.time() - start)
             h = dt // (60*60)
@@ -1187,140 +1170,20 @@ class MyWidget(QtWidgets.QWidget):
 
             QtCore.QCoreApplication.processEvents()
 
-            ret, img = self.video.read()
-            if ret:
-                for i in range(self.VID_SCALE):
-                    use_stamp = stamp+((step/self.VID_SCALE)*(i))
-                    use_img = img.copy()
-                    orig = use_img.copy()
-
-                    # Update text boxes if highlighting
-                    if self.highlight_box.isChecked():
-                        boxes = get_text_boxes(orig,prev_img,boxes)
-                    # Draw Saccades
-                    if current_saccade != -1:
-                        current_saccade = self.draw_saccade(use_img, use_stamp, current_saccade, saccades)
-                    # Draw Gazes
-                    if current_gaze != -1:
-                        current_gaze, begin_gaze_window = self.draw_gaze(use_img, use_stamp, current_gaze, gazes, begin_gaze_window)
-                    # Draw Fixations
-                    if current_fixation != -1:
-                        current_fixation, begin_fixation_window = self.draw_fixation(use_img, use_stamp, current_fixation, fixations, fixation_gazes, begin_fixation_window, boxes)
-
-                    video_out.write(use_img)
-                    count += 1
-                    prev_img = orig
-
-
-                stamp += step
-            else:
-                break
-        self.video.release()
-        self.video = cv2.VideoCapture(self.video_path)
-        video_out.release()
-
-
-    def draw_fixation(self, frame, timestamp, current_fixation, fixations, fixation_gazes, begin_fixation_window, boxes):
-        begin_time_stamp = timestamp - self.ROLLING_WIN_SIZE
-
-        if current_fixation < len(fixations):
-            check_fix = fixations[current_fixation]
-            check_fix_time = ConvertWindowsTime(check_fix.fixation_start_event_time) + check_fix.duration
-
-            check_begin_fix = fixations[begin_fixation_window]
-            check_begin_fix_time = ConvertWindowsTime(check_begin_fix.fixation_start_event_time) + check_begin_fix.duration
-            # find the new current fixation to print
-            while check_fix_time <= timestamp:
-                current_fixation += 1
-                if current_fixation == len(fixations):
-                    current_fixation -= 1
-                    break
-                check_fix = fixations[current_fixation]
-                check_fix_time = ConvertWindowsTime(check_fix.fixation_start_event_time) + check_fix.duration
-            # Find the new beginning of rolling window:
-            if begin_time_stamp > 0:
-                while check_begin_fix_time <= begin_time_stamp:
-                    begin_fixation_window += 1
-                    if begin_fixation_window == len(fixations):
-                        begin_fixation_window -= 1
-                        break
-                    check_begin_fix = fixations[begin_fixation_window]
-                    check_begin_fix_time = ConvertWindowsTime(check_begin_fix.fixation_start_event_time) + check_begin_fix.duration
-
-            # Draw fixations in the rolling window
-            for i in fixations[begin_fixation_window:current_fixation]:
-                try:
-                    if(int(i.x) < frame.shape[0] and int(i.y) < frame.shape[1] and int(i.x) > 0 and int(i.y) > 0):
-                        self.draw_circle(frame, (int(i.x)), (int(i.y)), self.FIXATION_RADIUS + i.duration // 50, self.fixationColor, ((self.ROLLING_WIN_SIZE - (timestamp - (ConvertWindowsTime(i.fixation_start_event_time)+i.duration))) / self.ROLLING_WIN_SIZE) * 100)
-                except ValueError:
-                    pass
-
-            self.draw_circle(frame, (int(fixations[current_fixation].x)), (int(fixations[current_fixation].y)), self.FIXATION_RADIUS + int(timestamp - (ConvertWindowsTime(fixations[current_fixation].fixation_start_event_time))) // 50, self.fixationColor, 100)
-            if self.highlight_box.isChecked():
-                highlight_frame(frame,boxes,fixations[current_fixation],self.highlightColor)
-            # move the fixation_gazes into the draw gazes. check if the gazes are part of a fixation_gazes and then change color
-
-            return current_fixation, begin_fixation_window
-        else:
-            return -1, -1
-
-    def draw_gaze(self, frame, timestamp, current_gaze, gazes, begin_gaze_window): # returns the next gaze number
-        begin_time_stamp = timestamp - self.ROLLING_WIN_SIZE
-        
-        if current_gaze < len(gazes):
-            check_gaze = gazes[current_gaze]
-            check_gaze_time = check_gaze.system_time
-            
-            check_begin_gaze = gazes[begin_gaze_window]
-            check_begin_gaze_time = check_begin_gaze.system_time
-            
-            while check_gaze_time <= timestamp:
-                current_gaze += 1
-                check_gaze = gazes[current_gaze]
-                check_gaze_time = check_gaze.system_time
-            
-            if begin_time_stamp > 0:
-                while check_begin_gaze_time <= begin_time_stamp: #loop until the begging gaze is within the timeframe of the rolling window
-                    begin_gaze_window += 1
-                    check_begin_gaze = gazes[begin_gaze_window]
-                    check_begin_gaze_time = check_begin_gaze.system_time
-            
-            transparency_increment = 100 / (current_gaze + 1 - begin_gaze_window) # Amount to increment
-            transparency = int(transparency_increment) # Percentage value
-            for i in gazes[begin_gaze_window: current_gaze + 1]:
-                try: 
-                    self.draw_circle(frame, (int(i.x)), (int(i.y)), self.GAZE_RADIUS, self.gazeColor, transparency)
-                    if(transparency + transparency_increment < 100): # Increase transparency until 100%
-                        transparency += transparency_increment 
-                except ValueError:
-                    pass
-            
-            return current_gaze, begin_gaze_window
-        else:
-            return -1, -1
-
-    def draw_saccade(self, frame, timestamp, current_saccade, saccades):
-        if current_saccade < len(saccades):
-            check_saccade = saccades[current_saccade]
-            check_saccade_time = check_saccade[-1].system_time
-            while check_saccade_time <= timestamp:
-                current_saccade += 1
-                check_saccade = saccades[current_saccade]
-                check_saccade_time = check_saccade[-1].system_time
-
-            if check_saccade[0].system_time <= timestamp:
-                for i in range(len(check_saccade)-1):
-                    cv2.line(frame, (int(check_saccade[i].x), int(check_saccade[i].y)), (int(check_saccade[i+1].x), int(check_saccade[i+1].y)), self.saccadeColor, 2)
-
-            return current_saccade
+        start_frame, end_frame = clip if clip is not None else (0, None)
+        encoder = EncoderSettings("ffmpeg" if self.ffmpeg_encode_box.isChecked() else "opencv")
+        frame_step = DraftFrameStep(self.video.get(cv2.CAP_PROP_FPS)) if self.draft_box.isChecked() else 1
+        if processes > 1 and stream is None:
+            RenderVideoParallel(renderer, self.video_path, output_file_name, processes=processes, progress=progress, start_frame=start_frame, end_frame=end_frame,
+                                encoder=encoder, frame_step=frame_step)
         else:
-            return -1
+            renderer.render(self.video_path, output_file_name, start_frame, end_frame, progress=progress, encoder=encoder, frame_step=frame_step)
 
     def generateCodeHeatmap(self):
         if(self.code_idb == None or self.code_srcml == None or len(self.code_fixation_runs_list.selectedItems()) == 0):
             QtWidgets.QMessageBox.critical(self, "Error", "You are missing a required component")
             return
-        srcml_root = self.code_srcml.getroot()
+        archive = self.code_srcml
 
         output_folder_name = QtWidgets.QFileDialog.getExistingDirectory(self,"Open Directory")
         if not output_folder_name:
@@ -1328,13 +1191,13 @@ class MyWidget(QtWidgets.QWidget):
 
         output_data = {}
         text_data = {}
+        category_data = {}
 
         for fixation_run in self.code_fixation_runs_list.selectedItems():
 
             fixation_run_id = int(fixation_run.text().split(" - ")[1])
             session_id = int(fixation_run.text().split(" - ")[2])
 
-            xml_remover = re.compile("<.*?>")
             # At 28 Font size, bounding boxes are 17x28
             #    32 Font size, bounding boxes are 19x31
             font = ImageFont.truetype("cour.ttf",32)
@@ -1342,10 +1205,7 @@ class MyWidget(QtWidgets.QWidget):
             W = 19
             H = 31
 
-            units = {}
-
-            for unit in srcml_root:
-                units[unit.attrib["filename"]] = unit
+            units = archive.units
 
             gazed_files = [x[0] for x in self.code_idb.GetFilesLookedAtBySession(session_id)]
 
@@ -1356,35 +1216,18 @@ class MyWidget(QtWidgets.QWidget):
                 unit = units[unit_target]
 
                 file = unit.attrib["filename"].split("/")[-1]
-                src_str = xml_remover.sub('',ET.tostring(unit).decode()).replace("&gt;",">").replace("&lt;","<").replace("&amp;","&")
+                src_str = archive.text(unit).text
 
 
-                draw_tokens = {}
                 fixation_tups = self.code_idb.GetAllRunFixationsTargetingFile(fixation_run_id,target_file)
                 fixations = [Fixation(tup) for tup in fixation_tups]
-                # fixations = [None]
-                for fixation in fixations:
-                    line_num = fixation.source_file_line
-                    col_num = fixation.source_file_col
-
-                    if line_num == -1 or col_num == -1:
-                        continue
-
-                    element = unit
-
-                    coords = FindTokenInElement(line_num,col_num,unit)
-
-                    if coords == None:
-                        continue
-                        # coords = ((line_num,col_num),(line_num,col_num))
-
-                    if coords not in draw_tokens:
-                        draw_tokens[coords] = 0
-
-                    if self.time_process_box.isChecked():
-                        draw_tokens[coords] += fixation.duration
-                    else:
-                        draw_tokens[coords] += 1
+                # Map the whole run to tokens at once. Fixations without a position (-1), or at line or col 0, fall outside the text
+                lines = [fixation.source_file_line for fixation in fixations]
+                cols = [fixation.source_file_col for fixation in fixations]
+                durations = [fixation.duration for fixation in fixations] if self.time_process_box.isChecked() else None
+                draw_tokens = CountTokens(archive.tokens(unit), lines, cols, durations)
+                # Totals by the tag of the innermost srcML element under each fixation
+                categories = CountCategories(archive.elements(unit), lines, cols, durations) if self.category_process_box.isChecked() else {}
 
                 if self.average_runs.isChecked():
                     min_count = min(list(draw_tokens.values()))
@@ -1398,12 +1241,15 @@ class MyWidget(QtWidgets.QWidget):
 
                     if file in output_data:
                         output_data[file] = {k : draw_tokens.get(k,0) + output_data[file].get(k,0) for k in set(draw_tokens) | set(output_data[file]) }
+                        category_data[file] = {k : categories.get(k,0) + category_data[file].get(k,0) for k in set(categories) | set(category_data[file]) }
                     else:
                         text_data[file] = src_str
                         output_data[file] = draw_tokens
+                        category_data[file] = categories
                 else:
                     output_data[f"{file}-{session_id}-{fixation_run_id}"] = draw_tokens
                     text_data[f"{file}-{session_id}-{fixation_run_id}"] = src_str
+                    category_data[f"{file}-{session_id}-{fixation_run_id}"] = categories
 
         for file in output_data:
             data = output_data[file]
@@ -1472,7 +1318,14 @@ class MyWidget(QtWidgets.QWidget):
 
                 cv2.imwrite(f"{output_folder_name}/{file}.png",img)
 
+            if self.category_process_box.isChecked():
+                with open(f"{output_folder_name}/{file}-categories.csv",'w') as out_file:
+                    out_file.write("category,total\n")
+                    for category, total in sorted(category_data[file].items(), key=lambda item: item[1], reverse=True):
+                        out_file.write(f"{category},{total}\n")
 
+
+        print(archive.summary())
         print("DONE!")
 
 
@@ -1525,6 +1378,11 @@ class MyWidget(QtWidgets.QWidget):
             current_frame += 1
 
 if __name__ == "__main__":
+    if sys.platform == "win32":
+        import ctypes
+        myappid = 'mycompany.myproduct.subproduct.version' # arbitrary string
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+
     app = QtWidgets.QApplication([])
     app.setWindowIcon(QtGui.QIcon("Visualize.png"))
     window = MyWidget()
@@ -1,4 +1,37 @@
 import sqlite3
+import sys
+
+from EyeDataTypes import GazeArray, FixationArray, FixationGazeArray, PositionArray, DEFAULT_BATCH_SIZE
+
+# Indexes that let every query iTraceDB runs search instead of scanning: (name, table, columns).
+# Trailing columns make the indexes covering for the time lookups, MIN/MAX and joins
+IDB_INDEXES = [
+    ("itv_gaze_session_time", "gaze", ("session_id", "system_time")),
+    ("itv_gaze_event_time", "gaze", ("event_time", "session_id", "system_time")),
+    ("itv_fixation_run_start", "fixation", ("fixation_run_id", "fixation_start_event_time")),
+    ("itv_fixation_run_target", "fixation", ("fixation_run_id", "fixation_target", "fixation_start_event_time")),
+    ("itv_fixation_start", "fixation", ("fixation_start_event_time", "fixation_target")),
+    ("itv_fixation_gaze_fixation", "fixation_gaze", ("fixation_id", "event_time")),
+    ("itv_fixation_run_session", "fixation_run", ("session_id",)),
+]
+
+# The hot queries, with placeholder parameters, for checking their plans with EXPLAIN QUERY PLAN
+IDB_HOT_QUERIES = {
+    "session gazes": ("""SELECT * FROM gaze WHERE session_id = ?""", (0,)),
+    "session gazes in time order": ("""SELECT * FROM gaze WHERE session_id = ? ORDER BY system_time""", (0,)),
+    "session time length": ("""SELECT MIN(system_time) FROM gaze WHERE session_id = ?""", (0,)),
+    "run fixations": ("""SELECT * FROM fixation WHERE fixation_run_id = ? ORDER BY fixation_start_event_time""", (0,)),
+    "run fixations on file": ("""SELECT * FROM fixation WHERE fixation_run_id = ? and fixation_target = ? ORDER BY fixation_start_event_time""", (0, "")),
+    "session fixation runs": ("""SELECT * FROM fixation_run WHERE session_id = ?""", (0,)),
+    "gaze at event time": ("""SELECT * FROM gaze WHERE event_time = ?""", (0,)),
+    "files looked at": ("""SELECT DISTINCT fixation_target FROM fixation INNER JOIN gaze ON fixation.fixation_start_event_time = gaze.event_time WHERE session_id = ?""", (0,)),
+    "run fixation gazes": ("""SELECT fixation_gaze.fixation_id, fixation_gaze.event_time, gaze.system_time FROM fixation_gaze
+                              INNER JOIN fixation ON fixation.fixation_id = fixation_gaze.fixation_id
+                              INNER JOIN fixation_run ON fixation_run.fixation_run_id = fixation.fixation_run_id
+                              LEFT JOIN gaze ON gaze.event_time = fixation_gaze.event_time AND gaze.session_id = fixation_run.session_id
+                              WHERE fixation.fixation_run_id = ?
+                              ORDER BY fixation.fixation_start_event_time, fixation.fixation_id, fixation_gaze.event_time""", (0,)),
+}
 
 IDB_TABLES = ["calibration","calibration_point","calibration_sample","files","fixation","fixation_gaze","fixation_run","gaze","ide_context","participant","session","web_context"]
 
@@ -11,10 +44,18 @@ class IDBDoesNotMatch(Exception):
 
 # Main iTrace Database Class
 class iTraceDB:
-    def __init__(self, path):
+    # create_indexes opts in to writing any missing IDB_INDEXES into the database file.
+    # Otherwise the missing indexes are only reported
+    def __init__(self, path, create_indexes=False):
         self.db = sqlite3.connect(path)
         self.cursor = self.db.cursor()
         self._verify()
+        self.missing_indexes = self.GetMissingIndexes()
+        if len(self.missing_indexes) != 0:
+            if create_indexes:
+                self.CreateIndexes(self.missing_indexes)
+            else:
+                print("Database is missing indexes on:", ", ".join(f"{table}({', '.join(columns)})" for _, table, columns in self.missing_indexes))
 
     # Verify the Database is a valid iTrace Database
     def _verify(self):
@@ -25,6 +66,40 @@ class iTraceDB:
             if x[0] not in IDB_TABLES:
                 raise IDBDoesNotMatch
 
+    # Returns the column lists of the existing indexes on a table, including primary key and unique indexes
+    def GetIndexedColumns(self, table):
+        indexed = []
+        for index in self.cursor.execute(f"""PRAGMA index_list('{table}')""").fetchall():
+            columns = self.db.execute(f"""PRAGMA index_info('{index[1]}')""").fetchall()
+            indexed.append(tuple(column[2] for column in sorted(columns)))
+        return indexed
+
+    # Returns the IDB_INDEXES whose columns are not the leading columns of an existing index
+    def GetMissingIndexes(self):
+        missing = []
+        for name, table, columns in IDB_INDEXES:
+            if not any(existing[:len(columns)] == columns for existing in self.GetIndexedColumns(table)):
+                missing.append((name, table, columns))
+        return missing
+
+    # Creates the given indexes (all missing IDB_INDEXES by default). This writes to the database file
+    def CreateIndexes(self, indexes=None):
+        if indexes is None:
+            indexes = self.GetMissingIndexes()
+        for name, table, columns in indexes:
+            print(f"Creating index {name} on {table}({', '.join(columns)})")
+            self.cursor.execute(f"""CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})""")
+        self.db.commit()
+        self.missing_indexes = self.GetMissingIndexes()
+
+    # Returns the EXPLAIN QUERY PLAN detail lines of a query
+    def ExplainQueryPlan(self, query, params=()):
+        return [row[-1] for row in self.cursor.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()]
+
+    # Returns the query plans of every IDB_HOT_QUERIES query, keyed by query name
+    def ExplainHotQueries(self):
+        return {name: self.ExplainQueryPlan(query, params) for name, (query, params) in IDB_HOT_QUERIES.items()}
+
     # Get all the sessions from the database
     def GetSessions(self):
         sessions = self.cursor.execute("""SELECT * FROM session""").fetchall()
@@ -75,17 +150,81 @@ class iTraceDB:
     def GetAllRunFixations(self, run_id):
         return self.cursor.execute("""SELECT * FROM fixation WHERE fixation_run_id = ? ORDER BY fixation_start_event_time""", (run_id,)).fetchall()
 
+    # Returns all the gazes from a session as a GazeArray, built from the cursor in batches
+    def GetSessionGazeArray(self, session_id, batch_size=DEFAULT_BATCH_SIZE):
+        cursor = self.db.execute("""SELECT * FROM gaze WHERE session_id = ?""", (session_id,))
+        return GazeArray.from_cursor(cursor, batch_size)
+
+    # Returns all the fixations from a fixation run as a FixationArray, built from the cursor in batches
+    def GetRunFixationArray(self, run_id, batch_size=DEFAULT_BATCH_SIZE):
+        cursor = self.db.execute("""SELECT * FROM fixation WHERE fixation_run_id = ? ORDER BY fixation_start_event_time""", (run_id,))
+        return FixationArray.from_cursor(cursor, batch_size)
+
+    # Returns the x/y positions of all the fixations of a fixation run as a PositionArray
+    def GetRunFixationPositions(self, run_id, batch_size=DEFAULT_BATCH_SIZE):
+        cursor = self.db.execute("""SELECT x, y FROM fixation WHERE fixation_run_id = ?""", (run_id,))
+        return PositionArray.from_cursor(cursor, batch_size)
+
+    # Yields the gazes of a session in system_time order, as GazeArrays of up to batch_size gazes, optionally
+    # starting at start_time. Every stream reads from its own cursor, so several can be consumed side by side
+    def IterSessionGazes(self, session_id, batch_size=DEFAULT_BATCH_SIZE, start_time=None):
+        if start_time is None:
+            cursor = self.db.execute("""SELECT * FROM gaze WHERE session_id = ? ORDER BY system_time""", (session_id,))
+        else:
+            cursor = self.db.execute("""SELECT * FROM gaze WHERE session_id = ? AND system_time >= ? ORDER BY system_time""", (session_id, start_time))
+        return GazeArray.iter_cursor(cursor, batch_size)
+
+    # Yields the fixations of a fixation run in start time order, as FixationArrays of up to batch_size fixations,
+    # optionally starting at start_event_time
+    def IterRunFixations(self, run_id, batch_size=DEFAULT_BATCH_SIZE, start_event_time=None):
+        if start_event_time is None:
+            cursor = self.db.execute("""SELECT * FROM fixation WHERE fixation_run_id = ? ORDER BY fixation_start_event_time""", (run_id,))
+        else:
+            cursor = self.db.execute("""SELECT * FROM fixation WHERE fixation_run_id = ? AND fixation_start_event_time >= ? ORDER BY fixation_start_event_time""", (run_id, start_event_time))
+        return FixationArray.iter_cursor(cursor, batch_size)
+
+    # Yields the fixation_gazes of a fixation run in the system_time order of their gazes, as FixationGazeArrays
+    # of up to batch_size rows, optionally starting at start_time. fixation_gazes without a gaze in the session are left out
+    def IterRunFixationGazes(self, run_id, batch_size=DEFAULT_BATCH_SIZE, start_time=None):
+        cursor = self.db.execute("""SELECT fixation_gaze.fixation_id, fixation_gaze.event_time, gaze.system_time FROM fixation_gaze
+                                    INNER JOIN fixation ON fixation.fixation_id = fixation_gaze.fixation_id
+                                    INNER JOIN fixation_run ON fixation_run.fixation_run_id = fixation.fixation_run_id
+                                    INNER JOIN gaze ON gaze.event_time = fixation_gaze.event_time AND gaze.session_id = fixation_run.session_id
+                                    WHERE fixation.fixation_run_id = ? AND (? IS NULL OR gaze.system_time >= ?)
+                                    ORDER BY gaze.system_time""", (run_id, start_time, start_time))
+        return FixationGazeArray.iter_cursor(cursor, batch_size)
+
+    # Returns the latest system_time, at or before time, of a gaze belonging to a fixation of the fixation run, or None
+    def GetRunFixationGazeTimeBefore(self, run_id, time):
+        return self.cursor.execute("""SELECT MAX(gaze.system_time) FROM fixation_gaze
+                                      INNER JOIN fixation ON fixation.fixation_id = fixation_gaze.fixation_id
+                                      INNER JOIN fixation_run ON fixation_run.fixation_run_id = fixation.fixation_run_id
+                                      INNER JOIN gaze ON gaze.event_time = fixation_gaze.event_time AND gaze.session_id = fixation_run.session_id
+                                      WHERE fixation.fixation_run_id = ? AND gaze.system_time <= ?""", (run_id, time)).fetchall()[0][0]
+
+    # Returns the longest duration and the latest start event time of the fixations of a fixation run
+    def GetRunFixationExtents(self, run_id):
+        return self.cursor.execute("""SELECT MAX(duration), MAX(fixation_start_event_time) FROM fixation WHERE fixation_run_id = ?""", (run_id,)).fetchall()[0]
+
+    # Returns the system_time of the last gaze of a session
+    def GetSessionEndTime(self, session_id):
+        return self.cursor.execute("""SELECT MAX(system_time) FROM gaze WHERE session_id = ?""", (session_id,)).fetchall()[0][0]
+
     # Returns all the fixations from a fixation run and on a certain file
     def GetAllRunFixationsTargetingFile(self, run_id,target_file):
         return self.cursor.execute("""SELECT * FROM fixation WHERE fixation_run_id = ? and fixation_target = ? ORDER BY fixation_start_event_time""", (run_id,target_file)).fetchall()
 
 
-    # Returns a dictionary of fixation_gazes for the selected fixation_run
-    def GetAllFixationGazes(self,fixations):
-        all_fix_gazes = {}
-        for fixation in fixations:
-            all_fix_gazes[fixation.fixation_id] = self.cursor.execute("""SELECT * FROM fixation_gaze WHERE fixation_id = ?""", (fixation.fixation_id,)).fetchall()
-        return all_fix_gazes
+    # Returns all the fixation_gazes of a fixation_run, with the system_time of their gaze, as a FixationGazeArray.
+    # Loaded with one joined query ordered so the rows of each fixation are contiguous
+    def GetRunFixationGazes(self, run_id, batch_size=DEFAULT_BATCH_SIZE):
+        cursor = self.db.execute("""SELECT fixation_gaze.fixation_id, fixation_gaze.event_time, gaze.system_time FROM fixation_gaze
+                                    INNER JOIN fixation ON fixation.fixation_id = fixation_gaze.fixation_id
+                                    INNER JOIN fixation_run ON fixation_run.fixation_run_id = fixation.fixation_run_id
+                                    LEFT JOIN gaze ON gaze.event_time = fixation_gaze.event_time AND gaze.session_id = fixation_run.session_id
+                                    WHERE fixation.fixation_run_id = ?
+                                    ORDER BY fixation.fixation_start_event_time, fixation.fixation_id, fixation_gaze.event_time""", (run_id,))
+        return FixationGazeArray.from_cursor(cursor, batch_size)
 
     # Returns the gaze that happened at a specified event_time
     def GetGazeFromEventTime(self,event_time):
@@ -110,3 +249,15 @@ class iTraceDB:
 
 
 
+
+
+# Reports missing indexes and the plans of the hot queries, and creates the indexes with --create-indexes
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python iTraceDB.py DATABASE [--create-indexes]")
+        sys.exit(1)
+    idb = iTraceDB(sys.argv[1], create_indexes="--create-indexes" in sys.argv[2:])
+    for name, plan in idb.ExplainHotQueries().items():
+        print(f"{name}:")
+        for line in plan:
+            print(f"    {line}")
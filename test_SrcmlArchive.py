@@ -0,0 +1,18 @@
+from SrcmlArchive import UnitText, TokenIndex, CountTokens
+
+TEXT = "int foo = 42;\n  bar++;\n"
+
+# Fixations at col 0 or line 0 are on no token, both for single lookups and for counting a whole run
+def test_col_zero_fixation():
+    tokens = TokenIndex(UnitText(TEXT))
+    assert tokens.find(1, 0) is None
+    assert tokens.find(0, 1) is None
+    assert CountTokens(tokens, [1, 1, 0, 2], [5, 0, 5, 3]) == {((1, 5), (1, 7)): 1, ((2, 3), (2, 5)): 1}
+
+# find gives the span of the token lookup finds, for every position in and around the text
+def test_find_matches_lookup():
+    tokens = TokenIndex(UnitText(TEXT))
+    positions = [(line, col) for line in range(-1, 5) for col in range(-1, 16)]
+    ids = tokens.lookup([line for line, _ in positions], [col for _, col in positions])
+    for (line, col), token in zip(positions, ids):
+        assert tokens.find(line, col) == (tokens.span(token) if token != -1 else None)
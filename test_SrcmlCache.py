@@ -0,0 +1,60 @@
+import numpy as np
+
+from SrcmlArchive import SrcmlArchive, CountTokens
+from SrcmlCache import CachedSrcmlArchive, CachedUnit
+
+ARCHIVE = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<unit xmlns="http://www.srcML.org/srcML/src" xmlns:pos="http://www.srcML.org/srcML/position" revision="1.0.0">
+
+<unit revision="1.0.0" language="C++" filename="a.cpp"><expr_stmt pos:start="1:1" pos:end="1:9"><name pos:start="1:1" pos:end="1:3">foo</name> <operator pos:start="1:5" pos:end="1:5">=</operator> <literal pos:start="1:7" pos:end="1:8">42</literal>;</expr_stmt>
+</unit>
+
+<unit revision="1.0.0" language="C++" filename="b.cpp"><expr_stmt pos:start="1:1" pos:end="1:7"><name pos:start="1:1" pos:end="1:3">bar</name><operator pos:start="1:4" pos:end="1:5">++</operator>;</expr_stmt>
+</unit>
+
+<unit revision="1.0.0" language="C++" filename="c.cpp"><name pos:start="1:1" pos:end="1:3">baz</name>
+</unit>
+
+</unit>
+"""
+
+def write_archive(tmp_path):
+    path = tmp_path / "archive.xml"
+    path.write_text(ARCHIVE)
+    return str(path)
+
+def token_counts(archive, unit):
+    return CountTokens(archive.tokens(unit), [1, 1, 1, 1, 2], [1, 2, 5, 7, 1])
+
+# Units read from the cache and units parsed from the archive share the LRU, and evicting either kind
+# must not trip over the other
+def test_mixed_eviction(tmp_path):
+    path = write_archive(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    CachedSrcmlArchive.parse(path, cache_dir, max_units=1).unit("a.cpp")
+
+    archive = CachedSrcmlArchive.parse(path, cache_dir, max_units=1)
+    assert isinstance(archive.unit("a.cpp"), CachedUnit)
+    assert not isinstance(archive.unit("b.cpp"), CachedUnit)
+    assert isinstance(archive.unit("a.cpp"), CachedUnit)
+    assert isinstance(archive.unit("b.cpp"), CachedUnit)
+    assert not isinstance(archive.unit("c.cpp"), CachedUnit)
+    assert len(archive.loaded) == 1
+    assert len(archive.texts) == len(archive.token_indexes) == len(archive.element_indexes) == 1
+
+# Units read back from the cache give the same text and token lookups as a full parse
+def test_cached_units_match_parse(tmp_path):
+    path = write_archive(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    parsed = SrcmlArchive.parse(path)
+    for filename in parsed.units:
+        CachedSrcmlArchive.parse(path, cache_dir).unit(filename)
+
+    archive = CachedSrcmlArchive.parse(path, cache_dir)
+    for filename, element in parsed.units.items():
+        unit = archive.units[filename]
+        assert isinstance(unit, CachedUnit)
+        assert archive.text(unit).text == parsed.text(element).text
+        assert np.array_equal(archive.text(unit).line_offsets, parsed.text(element).line_offsets)
+        assert token_counts(archive, unit) == token_counts(parsed, element)
+        assert archive.elements(unit).find(1, 1) == parsed.elements(element).find(1, 1)
@@ -0,0 +1,44 @@
+import numpy as np
+
+from EyeDataTypes import GazeArray, FixationArray, FixationGazeArray, ConvertUnixTime
+from VideoRenderer import GazeVideoRenderer, SessionStream, GetSaccadeRanges
+
+SESSION_START = 1_700_000_000_000
+
+def chunks(store, size):
+    return (store[i:i + size] for i in range(0, len(store), size))
+
+# A 10 s session at 60 Hz whose fixations stop after fixations_until ms, so the gazes after them are one saccade
+# running to the end of the session
+def make_session(fixations_until):
+    rng = np.random.default_rng(0)
+    times = SESSION_START + np.arange(600) * 1000 // 60
+    gaze_rows = []
+    for i, t in enumerate(times):
+        x, y = (float("nan"), float("nan")) if i % 37 == 0 else (float(rng.integers(0, 320)), float(rng.integers(0, 240)))
+        gaze_rows.append((i, 1, 0, "p", 0, int(t), x, y) + (0.0,) * 14)
+    fixation_rows, fixation_gaze_rows = [], []
+    i = 0
+    while times[i] - SESSION_START < fixations_until:
+        members = range(i, i + int(rng.integers(6, 20)))
+        fixation_rows.append((len(fixation_rows), 1, int(ConvertUnixTime(int(times[members[0]]))), len(fixation_rows),
+                              float(rng.integers(0, 320)), float(rng.integers(0, 240)), "a.cpp", 1, 1, "x", "name", "", 0.0, 0.0,
+                              float(times[members[-1]] - times[members[0]])))
+        fixation_gaze_rows += [(len(fixation_rows) - 1, j, int(times[j])) for j in members]
+        i = members[-1] + int(rng.integers(4, 12))
+    return GazeArray.from_rows(gaze_rows), FixationArray.from_rows(fixation_rows), FixationGazeArray.from_rows(fixation_gaze_rows)
+
+# A streamed render draws the saccade after the last fixation whole, the same as a render of the loaded session,
+# while only buffering the gazes near the window
+def test_stream_matches_full_after_last_fixation():
+    gazes, fixations, fixation_gazes = make_session(3000)
+    full = GazeVideoRenderer(gazes, fixations, GetSaccadeRanges(gazes, fixation_gazes.system_time), SESSION_START, highlight=False)
+    stream = SessionStream(chunks(gazes, 50), chunks(fixations, 20), chunks(fixation_gazes, 50),
+                           read_gazes=lambda start_time: chunks(gazes[gazes.system_time >= start_time], 50))
+    streamed = GazeVideoRenderer.from_stream(stream, SESSION_START, stream_block=700, highlight=False)
+
+    frame = np.full((240, 320, 3), 200, dtype=np.uint8)
+    for timestamp in SESSION_START + np.arange(0, 10500, 50):
+        assert np.array_equal(streamed.render_frame(frame, timestamp), full.render_frame(frame, timestamp)), timestamp
+        assert len(stream.gazes) < 200
+    assert stream.open_saccade is not None